@@ -3,7 +3,6 @@
 import sys
 import os
 import cv2
-import time
 import queue
 import Camera
 import logging
@@ -11,6 +10,7 @@ import threading
 import RPCServer
 import MjpgServer
 import HiwonderSDK.Board as Board
+import HiwonderSDK.ActionGroupControl as AGC
 import Functions.Running as Running
 
 if sys.version_info.major == 2:
@@ -23,9 +23,12 @@ def startArmPi():
     global HWEXT, HWSONIC
 
     RPCServer.QUEUE = QUEUE_RPC
+    AGC.preloadActionGroups()  # read the action group files once at startup
 
     threading.Thread(target=RPCServer.startRPCServer,
                      daemon=True).start()  # rpc server
+    threading.Thread(target=RPCServer.startZmqRPCServer,
+                     daemon=True).start()  # rpc server for streamed commands
     threading.Thread(target=MjpgServer.startMjpgServer,
                      daemon=True).start()  # mjpg streamer server
     
@@ -34,25 +37,17 @@ def startArmPi():
     Running.cam = cam
 
     while True:
-        time.sleep(0.03)
-
-        # executive RPC command that need to be executed in this thread
-        while True:
-            try:
-                req, ret = QUEUE_RPC.get(False)
-                event, params, *_ = ret
-                ret[2] = req(params)  # executive RPC command
-                event.set()
-            except:
-                break
+        # executive RPC command that need to be executed in this thread,
+        # waiting for new ones until the next frame is due
+        RPCServer.runMainThreadQueue(0.03)
         #####
         # executive function games program：
         try:
             if Running.RunningFunc > 0 and Running.RunningFunc <= 6:
                 if cam.frame is not None:
-                    MjpgServer.img_show = Running.CurrentEXE().run(cam.frame.copy())
+                    MjpgServer.publish(Running.CurrentEXE().run(cam.frame.copy()))
                 else:
-                    MjpgServer.img_show = loading_picture
+                    MjpgServer.publish(loading_picture)
             else:
                 cam.frame = None
         except KeyboardInterrupt:
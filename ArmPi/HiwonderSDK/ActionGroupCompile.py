@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+Compile action groups from the .d6a SQLite format into the .d6b binary format
+
+Usage:
+    python3 ActionGroupCompile.py [action group files or directories]
+
+without arguments all action groups under /home/pi/ArmPi/ActionGroups/ are compiled
+
+.d6b layout, little endian:
+    header  magic b'D6AB', uint16 version, uint16 servo count, uint32 frame count, uint32 crc32 of the frame table
+    frame table  int32[frame count][1 + servo count], each row is the frame time in ms followed by the servo pulses
+
+the frame table can be memory mapped as it is, it has the same layout as the arrays of loadActionGroup
+'''
+import os
+import sys
+import glob
+import zlib
+import struct
+import numpy as np
+import sqlite3 as sql
+
+
+D6B_MAGIC = b'D6AB'
+D6B_VERSION = 1
+D6B_HEADER = struct.Struct('<4sHHII')
+
+MAX_SERVOS = 16
+PULSE_RANGE = (0, 1000)
+TIME_RANGE = (0, 30000)  # ms, the longest move time a bus servo accepts
+
+def read_d6a(path):
+    '''
+    :return: int32 array with one row (time, pulse of servo 1, pulse of servo 2, ...) per frame
+    '''
+    ag = sql.connect(path)
+    cu = ag.cursor()
+    cu.execute("select * from ActionGroup")
+    rows = cu.fetchall()
+    cu.close()
+    ag.close()
+    # the first column is the frame index, the second the frame time and the rest the servo pulses
+    if rows:
+        return np.array([row[1:] for row in rows], dtype=np.int32)
+    return np.zeros((0, 7), dtype=np.int32)
+
+def validate(frames):
+    '''
+    check that an action group can be sent to the servos as it is, raise ValueError otherwise
+    '''
+    if frames.ndim != 2 or not 2 <= frames.shape[1] <= MAX_SERVOS + 1:
+        raise ValueError("invalid frame table shape %s" % (frames.shape,))
+    if len(frames) == 0:
+        raise ValueError("action group has no frames")
+    times, pulses = frames[:, 0], frames[:, 1:]
+    bad = np.flatnonzero((times < TIME_RANGE[0]) | (times > TIME_RANGE[1]))
+    if len(bad):
+        raise ValueError("frame %d: time %d ms out of range %s" % (bad[0] + 1, times[bad[0]], TIME_RANGE))
+    bad = np.argwhere((pulses < PULSE_RANGE[0]) | (pulses > PULSE_RANGE[1]))
+    if len(bad):
+        frame, servo = bad[0]
+        raise ValueError("frame %d: servo %d pulse %d out of range %s"
+                         % (frame + 1, servo + 1, pulses[frame, servo], PULSE_RANGE))
+
+def write_d6b(path, frames):
+    '''
+    write a compiled action group, the file is written next to the target and then renamed over it,
+    so that a running player that has the old file memory mapped keeps reading the old frames
+    '''
+    frames = np.ascontiguousarray(frames, dtype='<i4')
+    validate(frames)
+    data = frames.tobytes()
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(D6B_HEADER.pack(D6B_MAGIC, D6B_VERSION, frames.shape[1] - 1, frames.shape[0], zlib.crc32(data)))
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def read_d6b(path):
+    '''
+    memory map a compiled action group
+    :return: read only int32 array in the layout of read_d6a
+    '''
+    with open(path, 'rb') as f:
+        header = f.read(D6B_HEADER.size)
+    if len(header) != D6B_HEADER.size:
+        raise ValueError("%s: truncated header" % path)
+    magic, version, servos, count, crc = D6B_HEADER.unpack(header)
+    if magic != D6B_MAGIC or version != D6B_VERSION:
+        raise ValueError("%s: not a version %d .d6b file" % (path, D6B_VERSION))
+    if os.path.getsize(path) != D6B_HEADER.size + count * (servos + 1) * 4:
+        raise ValueError("%s: size does not match the header" % path)
+    frames = np.memmap(path, dtype='<i4', mode='r', offset=D6B_HEADER.size, shape=(count, servos + 1))
+    if zlib.crc32(frames) != crc:
+        raise ValueError("%s: checksum mismatch" % path)
+    return frames
+
+def compile_action_group(path):
+    '''
+    compile a .d6a file into a .d6b file next to it
+    :return: path of the .d6b file
+    '''
+    out = os.path.splitext(path)[0] + '.d6b'
+    write_d6b(out, read_d6a(path))
+    return out
+
+if __name__ == '__main__':
+    paths = []
+    for arg in sys.argv[1:] or ['/home/pi/ArmPi/ActionGroups/']:
+        if os.path.isdir(arg):
+            paths += sorted(glob.glob(os.path.join(arg, '*.d6a')))
+        else:
+            paths.append(arg)
+    failed = 0
+    for path in paths:
+        try:
+            print('%s -> %s' % (path, compile_action_group(path)))
+        except Exception as e:
+            print('%s: %s' % (path, e))
+            failed += 1
+    sys.exit(1 if failed else 0)
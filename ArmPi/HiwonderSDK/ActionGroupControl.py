@@ -1,110 +1,320 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 import os
+import glob
 import time
 import threading
-import sqlite3 as sql
+import numpy as np
+from collections import OrderedDict
 from Board import *
+from ActionGroupCompile import read_d6a, read_d6b
+
+class ActionStatus:
+    '''
+    run state of the action groups, changed only while holding playback_cond
+    '''
+    def __init__(self):
+        self.running = False  # an action group is being played
+        self.paused = False
+        self.action = None  # action group of the runner thread
+        self.times = -1  # runs left for the runner thread, 0: unlimited, -1: idle
+        self.runs = 0  # runs the runner thread finished since the last change_action_value
+        self.finished = True  # the runner thread is idle and accepts a new action group
+
+    def as_dict(self):
+        return dict(vars(self))
 
-runningAction = False
 stopRunning = False
-online_action_num = None
-online_action_times = -1
-update_ok = False
-action_group_finish = True
- 
+
+ActionGroupsPath = "/home/pi/ArmPi/ActionGroups/"
+ACTION_CACHE_SIZE = 16  # number of action groups kept in memory
+action_cache = OrderedDict()  # action group name -> (newest file path, (mtime, inode), frames), least recently used first
+action_cache_lock = threading.Lock()
+
+playback_cond = threading.Condition()  # notified on every change of status and on stop, so that waiting threads react at once
+status = ActionStatus()
+LATE_FRAME = 0.005  # seconds, a frame written later than this after its deadline counts as late
+playback_stats = {'frames': 0, 'late_frames': 0, 'mean_lateness': 0.0, 'max_lateness': 0.0, 'mean_write_time': 0.0}
+last_pose = None  # pulses last sent by an action group, interpolated playback starts from here
+
 def stop_servo():
     for i in range(16):
         stopBusServo(i+1) 
 
 def stop_action_group():
-    global stopRunning, online_action_num, online_action_times, update_ok
-    update_ok = False
-    stopRunning = True
-    online_action_num = None
-    online_action_times = -1
-    time.sleep(0.1)
+    global stopRunning
+    with playback_cond:
+        status.action = None
+        status.times = -1
+        status.paused = False  # a stop also ends a pause, the next action group starts playing at once
+        if status.running:
+            stopRunning = True
+            playback_cond.notify_all()
+            # give the running action group a moment to stop
+            playback_cond.wait_for(lambda: not status.running, 0.1)
+
+def pause_action_group():
+    with playback_cond:
+        status.paused = True
+        playback_cond.notify_all()
+
+def resume_action_group():
+    with playback_cond:
+        status.paused = False
+        playback_cond.notify_all()
+
+def get_action_status():
+    '''
+    :return: copy of the run state, see ActionStatus
+    '''
+    with playback_cond:
+        return status.as_dict()
+
+def get_playback_stats():
+    '''
+    lateness of the frames of the last played action group
+    '''
+    return dict(playback_stats)
 
 def action_finish():
-    global action_group_finish
-    return action_group_finish  
+    return status.finished
+
+def loadActionGroup(actNum):
+    '''
+    load an action group into memory, it is read from the file again only after the file changed
+    a compiled .d6b file (see ActionGroupCompile.py) is memory mapped and preferred over an older .d6a file
+    :param actNum: action group name, character string stype
+    :return: int32 array with one row (time, pulse of servo 1, pulse of servo 2, ...) per frame, None if there is no such file
+    '''
+    path = None
+    version = None
+    for ext in (".d6b", ".d6a"):
+        try:
+            st = os.stat(ActionGroupsPath + actNum + ext)
+        except OSError:
+            continue
+        if version is None or st.st_mtime > version[0]:
+            # a recompiled file replaces the old one with a new inode, so it is read again
+            # even if its mtime equals the old one
+            path, version = ActionGroupsPath + actNum + ext, (st.st_mtime, st.st_ino)
+    if path is None:
+        return None
+    with action_cache_lock:
+        cached = action_cache.get(actNum)
+        if cached is not None and cached[0] == path and cached[1] == version:
+            action_cache.move_to_end(actNum)
+            return cached[2]
+
+    frames = None
+    if path.endswith(".d6b"):
+        try:
+            frames = read_d6b(path)
+        except Exception as e:
+            # a broken compiled file is skipped until it changes again
+            print(e)
+            if not os.path.exists(ActionGroupsPath + actNum + ".d6a"):
+                return None
+    if frames is None:
+        frames = read_d6a(ActionGroupsPath + actNum + ".d6a")
+        frames.setflags(write=False)
+
+    with action_cache_lock:
+        action_cache[actNum] = (path, version, frames)
+        action_cache.move_to_end(actNum)
+        while len(action_cache) > ACTION_CACHE_SIZE:
+            action_cache.popitem(last=False)
+    return frames
+
+def preloadActionGroups():
+    '''
+    load all action groups, so that the first run of each does not have to read its file
+    :return: number of loaded action groups
+    '''
+    count = 0
+    names = set(os.path.basename(path)[:-4] for path in glob.glob(ActionGroupsPath + "*.d6[ab]"))
+    for name in sorted(names)[:ACTION_CACHE_SIZE]:
+        try:
+            if loadActionGroup(name) is not None:
+                count += 1
+        except Exception as e:
+            print(e)
+    return count
 
-def runAction(actNum):
+def wait_frame(deadline):
     '''
-    running action group，can not send stop signal
+    wait for the deadline of the next frame, the time spent paused moves the deadline back
+    :return: the deadline, None if the action group was stopped
+    '''
+    global stopRunning
+    with playback_cond:
+        while not stopRunning:
+            now = time.monotonic()
+            if status.paused:
+                playback_cond.wait()
+                deadline += time.monotonic() - now
+            elif now < deadline:
+                playback_cond.wait(deadline - now)
+            else:
+                return deadline
+        stopRunning = False
+    return None
+
+def interpolateFrames(frames, start_pose=None, control_rate=50, interpolation='minjerk'):
+    '''
+    resample the keyframes of an action group into a trajectory with a fixed time step
+    :param frames: array from loadActionGroup
+    :param start_pose: pulses the trajectory starts from, None starts at the first keyframe
+    :param control_rate: samples per second
+    :param interpolation: 'minjerk' stops smoothly at every keyframe, 'cubic' passes through them without stopping
+    :return: array in the same layout as frames, one row per sample
+    '''
+    durations = frames[:, 0] / 1000.0
+    poses = frames[:, 1:].astype(np.float64)
+    if start_pose is None or len(start_pose) != poses.shape[1]:
+        start_pose = poses[0]
+    knot_t = np.concatenate(([0.0], np.cumsum(np.maximum(durations, 1e-3))))
+    knot_p = np.vstack((np.asarray(start_pose, dtype=np.float64), poses))
+
+    dt = 1.0 / control_rate
+    t = np.arange(1, int(np.ceil(knot_t[-1] / dt)) + 1) * dt
+    t[-1] = knot_t[-1]
+    seg = np.clip(np.searchsorted(knot_t, t) - 1, 0, len(knot_t) - 2)
+    h = knot_t[seg + 1] - knot_t[seg]
+    tau = ((t - knot_t[seg]) / h)[:, None]
+    p0, p1 = knot_p[seg], knot_p[seg + 1]
+
+    if interpolation == 'cubic':
+        # cubic hermite spline, the velocity at a keyframe is the slope between its neighbours,
+        # limited so that a servo never overshoots a keyframe
+        d = np.diff(knot_p, axis=0) / np.diff(knot_t)[:, None]
+        m = np.zeros_like(knot_p)
+        m[1:-1] = (knot_p[2:] - knot_p[:-2]) / (knot_t[2:] - knot_t[:-2])[:, None]
+        m[1:-1] = np.where(d[:-1] * d[1:] > 0, m[1:-1], 0.0)
+        m[1:-1] = np.clip(m[1:-1], -3 * np.minimum(abs(d[:-1]), abs(d[1:])), 3 * np.minimum(abs(d[:-1]), abs(d[1:])))
+        m0, m1 = m[seg] * h[:, None], m[seg + 1] * h[:, None]
+        tau2, tau3 = tau ** 2, tau ** 3
+        samples = ((2 * tau3 - 3 * tau2 + 1) * p0 + (tau3 - 2 * tau2 + tau) * m0
+                   + (-2 * tau3 + 3 * tau2) * p1 + (tau3 - tau2) * m1)
+    elif interpolation == 'minjerk':
+        samples = p0 + (p1 - p0) * (tau ** 3 * (10 - 15 * tau + 6 * tau ** 2))
+    else:
+        raise ValueError("Invalid interpolation: %s" % interpolation)
+
+    sample_time = np.diff(np.concatenate(([0.0], t))) * 1000.0
+    return np.column_stack((np.round(sample_time), np.clip(np.round(samples), 0, 1000))).astype(np.int32)
+
+def runAction(actNum, interpolation=None, control_rate=50):
+    '''
+    running action group, stop_action_group stops it and pause_action_group pauses it at once
+    the frames are sent at absolute deadlines, so the time spent writing does not add up
     :param actNum: action group name, character string stype
-    :param times: run times
-    :return:
+    :param interpolation: None sends the keyframes as they are, 'minjerk' or 'cubic' sends a smooth
+                          trajectory at control_rate that starts from the pose the previous group ended in
+    :param control_rate: samples per second of the interpolated trajectory
+    :return: True if the action group was played, False if its file is missing or another one is playing
     '''
-    global runningAction
     global stopRunning
-    global online_action_times
+    global last_pose
     if actNum is None:
-        return
-    actNum = "/home/pi/ArmPi/ActionGroups/" + actNum + ".d6a"
-    stopRunning = False
-    if os.path.exists(actNum) is True:
-        if runningAction is False:
-            runningAction = True
-            ag = sql.connect(actNum)
-            cu = ag.cursor()
-            cu.execute("select * from ActionGroup")
-            while True:
-                act = cu.fetchone()
-                if stopRunning is True:
-                    stopRunning = False                   
+        return False
+    frames = loadActionGroup(actNum)
+    if frames is not None:
+        with playback_cond:
+            if status.running:
+                return False
+            status.running = True
+            status.paused = False
+            stopRunning = False
+        try:
+            if interpolation is not None and len(frames) > 0:
+                frames = interpolateFrames(frames, last_pose, control_rate, interpolation)
+            lateness = []
+            write_time = 0.0
+            deadline = time.monotonic()
+            for act in frames.tolist():
+                deadline = wait_frame(deadline)
+                if deadline is None:
                     break
-                if act is not None:
-                    for i in range(0, len(act)-2, 1):
-                        setBusServoPulse(i+1, act[2 + i], act[1])
-                    time.sleep(float(act[1])/1000.0)
-                else:   # run complete exit
-                    break
-            runningAction = False
-            
-            cu.close()
-            ag.close()
+                t_write = time.monotonic()
+                lateness.append(t_write - deadline)
+                if interpolation is None:
+                    for i in range(0, len(act)-1, 1):
+                        setBusServoPulse(i+1, act[1 + i], act[0])
+                else:
+                    # all servos of a sample in one serial write
+                    setBusServosPulse([(i+1, act[1 + i], act[0]) for i in range(len(act)-1)])
+                last_pose = act[1:]
+                write_time += time.monotonic() - t_write
+                deadline += float(act[0])/1000.0
+            else:
+                wait_frame(deadline)  # let the last frame finish its movement
+        finally:
+            with playback_cond:
+                status.running = False
+                playback_cond.notify_all()
+
+        if lateness:
+            playback_stats.update({'frames': len(lateness),
+                                   'late_frames': sum(1 for l in lateness if l > LATE_FRAME),
+                                   'mean_lateness': sum(lateness) / len(lateness),
+                                   'max_lateness': max(lateness),
+                                   'mean_write_time': write_time / len(lateness)})
+        return True
     else:
-        runningAction = False
         print("could not find the action group file")
+        return False
 
 def online_thread_run_acting():
-    global online_action_times, online_action_num, update_ok, action_group_finish
+    '''
+    runner thread, sleeps until change_action_value gives it an action group
+    '''
     while True:
-        if update_ok:
-            if online_action_times == 0:
-                # unlimited runs
-                if action_group_finish:
-                    action_group_finish = False
-                runAction(online_action_num)                
-            elif online_action_times > 0:
-                # limited runs
-                if action_group_finish:
-                    action_group_finish = False
-                runAction(online_action_num)
-                online_action_times -= 1    # after running, enter no-load                 
-                if online_action_times == 0:
-                    online_action_times = -1
-            else:
-                # no-load
-                if not action_group_finish:
-                    action_group_finish = True
-                time.sleep(0.001)
-        else:
-            if not action_group_finish:
-                action_group_finish = True
-            time.sleep(0.001)
-            
+        with playback_cond:
+            while status.action is None or status.times < 0:
+                if not status.finished:
+                    status.finished = True
+                    playback_cond.notify_all()
+                playback_cond.wait()
+            actNum = status.action
+            status.finished = False
+        if loadActionGroup(actNum) is None:
+            # nothing to repeat, end the runs instead of retrying
+            print("could not find the action group file")
+            with playback_cond:
+                if status.action == actNum:
+                    status.times = -1
+            continue
+        with playback_cond:
+            # another playback (e.g. an rpc RunAction) holds the servos, wait for it to end
+            while status.running and status.action == actNum and status.times >= 0:
+                playback_cond.wait()
+            if status.action != actNum or status.times < 0:
+                continue
+        if not runAction(actNum):
+            continue
+        with playback_cond:
+            if status.action == actNum and status.times >= 0:
+                status.runs += 1
+                if status.times > 0:
+                    # limited runs, enter no-load after the last one
+                    status.times -= 1
+                    if status.times == 0:
+                        status.times = -1
+
 def start_action_thread():
     th1 = threading.Thread(target=online_thread_run_acting)
     th1.setDaemon(True)  # set as the backend thread,the default is True here
     th1.start()
     
 def change_action_value(actNum, actTimes):
-    global online_action_times, online_action_num, update_ok, stopRunning, action_group_finish
-    
-    if action_group_finish:
-        online_action_times = actTimes
-        online_action_num = actNum
-        stopRunning = False
-        update_ok = True
+    '''
+    let the runner thread run an action group, ignored while it is still busy
+    :param actNum: action group name, character string stype
+    :param actTimes: number of runs, 0 runs it until stop_action_group
+    '''
+    with playback_cond:
+        if status.finished:
+            status.action = actNum
+            status.times = actTimes
+            status.runs = 0
+            playback_cond.notify_all()
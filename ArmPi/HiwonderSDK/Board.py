@@ -163,6 +163,20 @@ def setBusServoPulse(id, pulse, use_time):
     use_time = 30000 if use_time > 30000 else use_time
     serial_serro_wirte_cmd(id, LOBOT_SERVO_MOVE_TIME_WRITE, pulse, use_time)
 
+def setBusServosPulse(servos):
+    """
+    driver several serial servos with one serial write
+    :param servos: list of (id, pulse, use_time)
+    """
+    cmds = []
+    for id, pulse, use_time in servos:
+        pulse = 0 if pulse < 0 else pulse
+        pulse = 1000 if pulse > 1000 else pulse
+        use_time = 0 if use_time < 0 else use_time
+        use_time = 30000 if use_time > 30000 else use_time
+        cmds.append((id, LOBOT_SERVO_MOVE_TIME_WRITE, pulse, use_time))
+    serial_serro_wirte_cmds(cmds)
+
 def stopBusServo(id=None):
     '''
     stop servo run
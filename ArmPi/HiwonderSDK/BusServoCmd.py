@@ -75,16 +75,15 @@ def checksum(buf):
     sum = ~sum  # reverse
     return sum & 0xff
 
-def serial_serro_wirte_cmd(id=None, w_cmd=None, dat1=None, dat2=None):
+def serial_servo_cmd_buf(id=None, w_cmd=None, dat1=None, dat2=None):
     '''
-    写指令
+    build a write command frame
     :param id:
     :param w_cmd:
     :param dat1:
     :param dat2:
-    :return:
+    :return: frame bytes
     '''
-    portWrite()
     buf = bytearray(b'\x55\x55')  # frame header
     buf.append(id)
     # command hength
@@ -108,6 +107,30 @@ def serial_serro_wirte_cmd(id=None, w_cmd=None, dat1=None, dat2=None):
     buf.append(checksum(buf))
     # for i in buf:
     #     print('%x' %i)
+    return buf
+
+def serial_serro_wirte_cmd(id=None, w_cmd=None, dat1=None, dat2=None):
+    '''
+    写指令
+    :param id:
+    :param w_cmd:
+    :param dat1:
+    :param dat2:
+    :return:
+    '''
+    portWrite()
+    serialHandle.write(serial_servo_cmd_buf(id, w_cmd, dat1, dat2))  # send
+
+def serial_serro_wirte_cmds(cmds):
+    '''
+    send several write commands with a single serial write
+    :param cmds: list of (id, w_cmd, dat1, dat2)
+    :return:
+    '''
+    portWrite()
+    buf = bytearray()
+    for cmd in cmds:
+        buf.extend(serial_servo_cmd_buf(*cmd))
     serialHandle.write(buf)  # send
 
 def serial_servo_read_cmd(id=None, r_cmd=None):
@@ -7,12 +7,16 @@ import pygame
 import requests
 
 url = "http://127.0.0.1:9030/jsonrpc"
-cmd = {
-    "method":"SetBusServoPulse",
-    "params": [],
-    "jsonrpc": "2.0",
-    "id": 0,
-    }
+session = requests.Session()  # keep the connection to the rpc server open
+
+def command(batch, params):
+    # the servo changes of one loop are sent as one JSON-RPC batch, numbered in the order they were added
+    batch.append({
+        "method":"SetBusServoPulse",
+        "params": params,
+        "jsonrpc": "2.0",
+        "id": len(batch),
+        })
 
 step_width = 10
 key_map = {"PSB_CROSS":2, "PSB_CIRCLE":1, "PSB_SQUARE":3, "PSB_TRIANGLE":0,
@@ -59,68 +63,57 @@ while True:
             pygame.joystick.quit()
     if connected is True:
         pygame.event.pump()      
+        batch = []
         try:
             if js.get_button(key_map["PSB_R1"]) :
                 change[0] -= step_width
                 change[0] = 0 if change[0] < 0 else change[0]
-                cmd["params"] = [20, 1, 1, change[0]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 1, change[0]])
             if js.get_button(key_map["PSB_L1"])  :
                 change[0] += step_width
                 change[0] = 1000 if change[0] > 1000 else change[0]
-                cmd["params"] = [20, 1, 1, change[0]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 1, change[0]])
             if js.get_button(key_map["PSB_SQUARE"]) :
                 change[1] -= step_width
                 change[1] = 0 if change[1] < 0 else change[1]
-                cmd["params"] = [20, 1, 2, change[1]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 2, change[1]])
             if js.get_button(key_map["PSB_CIRCLE"]) :
                 change[1] += step_width
                 change[1] = 1000 if change[1] > 1000 else change[1]
-                cmd["params"] = [20, 1, 2, change[1]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 2, change[1]])
             if js.get_button(key_map["PSB_R2"]) :
                 change[2] += step_width
                 change[2] = 1000 if change[2] > 1000 else change[2]
-                cmd["params"] = [20, 1, 3, change[2]]
-                r = requests.post(url, json = cmd).json() 
+                command(batch, [20, 1, 3, change[2]])
             if js.get_button(key_map["PSB_L2"]) :
                 change[2] -= step_width
                 change[2] = 0 if change[2] < 0 else change[2]
-                cmd["params"] = [20, 1, 3, change[2]]
-                r = requests.post(url, json = cmd).json() 
+                command(batch, [20, 1, 3, change[2]])
             if js.get_button(key_map["PSB_TRIANGLE"]) :
                 change[3] += step_width
                 change[3] = 1000 if change[3] > 1000 else change[3]
-                cmd["params"] = [20, 1, 4, change[3]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 4, change[3]])
             if js.get_button(key_map["PSB_CROSS"]) :
                 change[3] -= step_width
                 change[3] = 0 if change[3] < 0 else change[3]
-                cmd["params"] = [20, 1, 4, change[3]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 4, change[3]])
             hat = js.get_hat(0)
             if hat[0] > 0 :
                 change[5] -= step_width
                 change[5] = 0 if change[5] < 0 else change[5]
-                cmd["params"] = [20, 1, 6, change[5]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 6, change[5]])
             elif hat[0] < 0:
                 change[5] += step_width
                 change[5] = 1000 if change[5] > 1000 else change[5]
-                cmd["params"] = [20, 1, 6, change[5]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 6, change[5]])
             if hat[1] > 0 :
                 change[4] -= step_width
                 change[4] = 0 if change[4] < 0 else change[4]
-                cmd["params"] = [20, 1, 5, change[4]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 5, change[4]])
             elif hat[1] < 0:
                 change[4] += step_width
                 change[4] = 0 if change[4] > 1000 else change[4]
-                cmd["params"] = [20, 1, 5, change[4]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 5, change[4]])
 
             lx = js.get_axis(0)
             ly = js.get_axis(1)
@@ -129,61 +122,52 @@ while True:
             if lx < -0.5 :
                 change[5] += step_width
                 change[5] = 1000 if change[5] > 1000 else change[5]
-                cmd["params"] = [20, 1, 6, change[5]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 6, change[5]])
             elif lx > 0.5:             
                 change[5] -= step_width
                 change[5] = 0 if change[5] < 0 else change[5]
-                cmd["params"] = [20, 1, 6, change[5]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 6, change[5]])
 
             l3_state = js.get_button(key_map["PSB_L3"])
             if ly < -0.5 :
                 if not l3_state:
                     change[4] -= step_width
                     change[4] = 0 if change[4] < 0 else change[4]
-                    cmd["params"] = [20, 1, 5, change[4]]
-                    r = requests.post(url, json = cmd).json()
+                    command(batch, [20, 1, 5, change[4]])
                 else:
                     change[3] += step_width
                     change[3] = 1000 if change[3] > 1000 else change[3]
-                    cmd["params"] = [20, 1, 4, change[3]]
-                    r = requests.post(url, json = cmd).json()
+                    command(batch, [20, 1, 4, change[3]])
             elif ly > 0.5:
                 if not l3_state:
                     change[4] += step_width
                     change[4] = 1000 if change[4] > 1000 else change[4]
-                    cmd["params"] = [20, 1, 5, change[4]]
-                    r = requests.post(url, json = cmd).json()
+                    command(batch, [20, 1, 5, change[4]])
                 else:
                     change[3] -= step_width
                     change[3] = 0 if change[3] < 0 else change[3]
-                    cmd["params"] = [20, 1, 4, change[3]]
-                    r = requests.post(url, json = cmd).json()
+                    command(batch, [20, 1, 4, change[3]])
             if rx > 0.5 :
                 change[1] += step_width
                 change[1] = 1000 if change[1] > 1000 else change[1]
-                cmd["params"] = [20, 1, 2, change[1]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 2, change[1]])
             elif rx < -0.5:
                 change[1] -= step_width
                 change[1] = 0 if change[1] < 0 else change[1]
-                cmd["params"] = [20, 1, 2, change[1]]
-                r = requests.post(url, json = cmd).json()
+                command(batch, [20, 1, 2, change[1]])
             if ry > 0.5 :
                 change[3] -= step_width
                 change[3] = 0 if change[3] < 0 else change[3]
-                cmd["params"] = [20, 1, 4, change[3]]
-                r = requests.post(url, json = cmd).json() 
+                command(batch, [20, 1, 4, change[3]])
             elif ry < -0.5:
                 change[3] += step_width
                 change[3] = 1000 if change[3] > 1000 else change[3]
-                cmd["params"] = [20, 1, 4, change[3]]
-                r = requests.post(url, json = cmd).json()                  
+                command(batch, [20, 1, 4, change[3]])
             if js.get_button(key_map["PSB_START"]):
                 change = [500,500,136,931,795,500]
-                cmd["params"] =  [1000, 6, 1, 500, 2, 500, 3, 136, 4, 931, 5, 795, 6, 500]
-                r = requests.post(url, json = cmd).json()                
+                command(batch, [1000, 6, 1, 500, 2, 500, 3, 136, 4, 931, 5, 795, 6, 500])
+            if batch:
+                r = session.post(url, json = batch).json()
         except Exception as e:
             print(e)
             connected = False          
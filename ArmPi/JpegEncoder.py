@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# coding=utf8
+import sys
+import threading
+import cv2
+import numpy as np
+
+if sys.version_info.major == 2:
+    print('Please run this program with python3!')
+    sys.exit(0)
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_444, TJSAMP_422, TJSAMP_420, TJSAMP_GRAY
+except ImportError:
+    TurboJPEG = None
+
+# chroma subsampling names accepted by the encoders
+SUBSAMPLINGS = ('444', '422', '420', 'gray')
+
+class OpenCVEncoder:
+    '''
+    jpeg encoder using cv2.imencode, always available
+    '''
+    name = 'opencv'
+
+    def __init__(self, subsampling='420'):
+        self.subsampling = subsampling
+        # the sampling factor flag only exists since opencv 4.5.5, older versions always use 4:2:0
+        factor = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_' + subsampling.upper(), None)
+        self.params = []
+        if factor is not None and hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+            self.params = [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(factor)]
+
+    def encode(self, img, quality=70):
+        '''
+        :param img: BGR image
+        :return: jpeg bytes
+        '''
+        if self.subsampling == 'gray' and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        ret, jpg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality] + self.params)
+        return jpg.tobytes()
+
+    def encode_yuv(self, yuv, width, height, quality=70):
+        '''
+        :param yuv: planar I420 buffer of width * height * 3 / 2 bytes
+        :return: jpeg bytes
+        '''
+        img = cv2.cvtColor(np.asarray(yuv).reshape(height * 3 // 2, width), cv2.COLOR_YUV2BGR_I420)
+        return self.encode(img, quality)
+
+class TurboJPEGEncoder:
+    '''
+    jpeg encoder using libjpeg-turbo through PyTurboJPEG
+
+    output buffers are kept per thread and reused, and I420 frames are encoded
+    without converting them to BGR first
+    '''
+    name = 'turbojpeg'
+
+    def __init__(self, subsampling='420', lib_path=None):
+        self.jpeg = TurboJPEG(lib_path)
+        self.subsampling = subsampling
+        self.subsample = {'444': TJSAMP_444, '422': TJSAMP_422, '420': TJSAMP_420, 'gray': TJSAMP_GRAY}[subsampling]
+        self.local = threading.local()
+        # output buffers can only be passed in since PyTurboJPEG 1.7
+        self.reuse = hasattr(self.jpeg, 'buffer_size')
+
+    def buffer(self, size):
+        buf = getattr(self.local, 'buf', None)
+        if buf is None or len(buf) < size:
+            buf = self.local.buf = bytearray(size)
+        return buf
+
+    def encode(self, img, quality=70):
+        '''
+        :param img: BGR image
+        :return: jpeg bytes
+        '''
+        img = np.ascontiguousarray(img)
+        if not self.reuse:
+            return self.jpeg.encode(img, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=self.subsample)
+        buf = self.buffer(self.jpeg.buffer_size(img, self.subsample))
+        buf, size = self.jpeg.encode(img, quality=quality, pixel_format=TJPF_BGR,
+                                     jpeg_subsample=self.subsample, dst=buf)
+        return bytes(memoryview(buf)[:size])
+
+    def encode_yuv(self, yuv, width, height, quality=70):
+        '''
+        :param yuv: planar I420 buffer of width * height * 3 / 2 bytes
+        :return: jpeg bytes
+        '''
+        yuv = np.ascontiguousarray(yuv)
+        if not self.reuse:
+            return self.jpeg.encode_from_yuv(yuv, height, width, quality=quality, jpeg_subsample=TJSAMP_420)
+        # the worst case of a yuv frame is not larger than that of the same frame in BGR
+        buf = self.buffer(width * height * 3 + 2048)
+        buf, size = self.jpeg.encode_from_yuv(yuv, height, width, quality=quality,
+                                              jpeg_subsample=TJSAMP_420, dst=buf)
+        return bytes(memoryview(buf)[:size])
+
+ENCODERS = {'opencv': OpenCVEncoder, 'turbojpeg': TurboJPEGEncoder}
+
+def getEncoder(prefer='turbojpeg', subsampling='420'):
+    '''
+    get a jpeg encoder, falling back to opencv if the preferred one can not be loaded
+    :param prefer: 'turbojpeg' or 'opencv'
+    :param subsampling: one of SUBSAMPLINGS
+    '''
+    if subsampling not in SUBSAMPLINGS:
+        raise ValueError("Invalid subsampling: %s" % subsampling)
+    if prefer == 'turbojpeg':
+        try:
+            if TurboJPEG is None:
+                raise ImportError('PyTurboJPEG is not installed')
+            return TurboJPEGEncoder(subsampling)
+        except Exception as e:
+            print('turbojpeg encoder not available, using opencv:', e)
+    return OpenCVEncoder(subsampling)
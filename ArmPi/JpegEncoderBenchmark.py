@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# coding=utf8
+'''
+compare the jpeg encoders on recorded frames
+
+Usage:
+    python3 JpegEncoderBenchmark.py [frame directory] [repeats]
+
+the frames default to the camera pictures saved for calibration
+'''
+import os
+import sys
+import glob
+import time
+import cv2
+import JpegEncoder
+
+if sys.version_info.major == 2:
+    print('Please run this program with python3!')
+    sys.exit(0)
+
+def load_frames(path):
+    frames = []
+    for name in sorted(glob.glob(os.path.join(path, '*.jpg')) + glob.glob(os.path.join(path, '*.png'))):
+        img = cv2.imread(name)
+        if img is not None:
+            frames.append(cv2.resize(img, (640, 480)))
+    return frames
+
+def run(encode, frames, quality, repeats):
+    total_bytes = 0
+    t_start = time.perf_counter()
+    for i in range(repeats):
+        for frame in frames:
+            total_bytes += len(encode(frame, quality))
+    count = repeats * len(frames)
+    return (time.perf_counter() - t_start) * 1000.0 / count, total_bytes / count
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              'CameraCalibration', 'calibration_images')
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    frames = load_frames(path)
+    if not frames:
+        print('no frames found in', path)
+        sys.exit(1)
+    yuv_frames = [cv2.cvtColor(f, cv2.COLOR_BGR2YUV_I420) for f in frames]
+    print('%d frames of 640x480 from %s, %d repeats' % (len(frames), path, repeats))
+    print('%-10s %-6s %-8s %8s %10s' % ('encoder', 'input', 'sampling', 'ms/frame', 'bytes'))
+
+    for name in JpegEncoder.ENCODERS:
+        for subsampling in ('420', '422', '444'):
+            encoder = JpegEncoder.getEncoder(name, subsampling)
+            if encoder.name != name:
+                break
+            for quality in (50, 70, 90):
+                ms, size = run(encoder.encode, frames, quality, repeats)
+                print('%-10s %-6s %-8s %8.2f %10d   quality %d' % (name, 'bgr', subsampling, ms, size, quality))
+        if encoder.name == name:
+            for quality in (50, 70, 90):
+                ms, size = run(lambda f, q: encoder.encode_yuv(f, 640, 480, q), yuv_frames, quality, repeats)
+                print('%-10s %-6s %-8s %8.2f %10d   quality %d' % (name, 'i420', '420', ms, size, quality))
@@ -12,63 +12,281 @@ if sys.version_info.major == 2:
     sys.exit(0)
 
 import cv2
-import time
-import queue
+import asyncio
 import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer,ThreadingHTTPServer
-from socketserver import ThreadingMixIn
-from io import StringIO, BytesIO
+from concurrent.futures import Future
+from urllib.parse import urlsplit, parse_qs
+from RateControl import RateController
+from JpegEncoder import getEncoder
 
 
 img_show = None
-quality = (int(cv2.IMWRITE_JPEG_QUALITY), 70)
+stream_quality = 70  # highest jpeg quality a stream is sent with
+snapshot_quality = 100
+stream_interval = 0.05  # minimum time between two frames sent to the same client
+stream_kbps = None  # default bitrate target of a stream, None only adapts to the frame rate
+encoder = getEncoder()  # turbojpeg if it is installed, opencv otherwise
 
-class MJPG_Handler(BaseHTTPRequestHandler):
-    def do_GET(self):
+def encode(img, quality, scale=1.0):
+    if scale != 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return encoder.encode(img, quality)
+
+class FrameBroadcaster:
+    '''
+    encode every published frame once per requested (quality, scale) and share the jpeg bytes with all clients
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.frame = None
+        self.encodes = {}  # (quality, scale) -> jpg_bytes of the current frame
+        self.pending = {}  # (quality, scale) -> Future of an encode of the current frame that is in progress
+        self.wanted = {}  # (quality, scale) -> number of stream clients subscribed to these settings
+        self.clients = 0
+        self.listeners = []  # called from the publishing thread after every new frame
+
+    def publish(self, img):
+        '''
+        publish a new frame, the same image object is only published once
+        :param img: BGR image
+        '''
         global img_show
-        if self.path == '/?action=snapshot':
-            if img_show is not None:
-                try:
-                    l_quality = (int(cv2.IMWRITE_JPEG_QUALITY), 100)
-                    ret, jpg = cv2.imencode('.jpg', img_show, l_quality) 
-                    jpg_bytes = jpg.tobytes()
-                    self.send_response(200)
-                    self.send_header('Content-type','image/jpeg')
-                    self.send_header('Content-length', len(jpg_bytes))
-                    self.end_headers()
-                    self.wfile.write(jpg_bytes)
-                except Exception as e:
-                    print(e)
-        else:
-            img_show = None
-            self.send_response(200)
-            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=--boundarydonotcross')
-            self.end_headers()
-            while True:
-                try:
-                    if img_show is not None:
-                        ret, jpg = cv2.imencode('.jpg', img_show, quality)
-                        jpg_bytes = jpg.tobytes()
-                        self.send_header('Content-type', 'image/jpeg')
-                        self.send_header('Content-length', len(jpg_bytes))
-                        #self.send_header('X-Timestamp:', time.time())
-                        self.wfile.write('--boundarydonotcross\r\n'.encode())
-                        self.end_headers()
-                        self.wfile.write(jpg_bytes)
-                    time.sleep(0.05)
-                except Exception as e:
-                    print(e,"EE")
+        if img is None or img is self.frame:
+            return
+        encodes = {}
+        if self.clients > 0:
+            # encode here, so that the stream clients only write out the shared bytes
+            with self.lock:
+                wanted = list(self.wanted)
+            for key in wanted:
+                encodes[key] = encode(img, *key)
+        with self.lock:
+            self.seq += 1
+            self.frame = img
+            self.encodes = encodes
+            self.pending = {}
+            img_show = img
+        for listener in self.listeners:
+            listener()
+
+    def subscribe(self, key, old_key=None):
+        '''
+        let publish() encode the following frames with the settings key = (quality, scale), for as long as
+        a stream client uses them
+        :param old_key: settings the client used so far, None for a new client
+        '''
+        with self.lock:
+            if old_key is not None:
+                self.unsubscribeLocked(old_key)
+            self.wanted[key] = self.wanted.get(key, 0) + 1
+
+    def unsubscribe(self, key):
+        with self.lock:
+            self.unsubscribeLocked(key)
+
+    def unsubscribeLocked(self, key):
+        self.wanted[key] -= 1
+        if self.wanted[key] == 0:
+            del self.wanted[key]
+
+    def ready(self, quality=stream_quality, scale=1.0):
+        return (quality, scale) in self.encodes
+
+    def encoded(self, quality=stream_quality, scale=1.0):
+        '''
+        get the latest frame with the given settings, encoding it if publish() did not
+        clients asking for the same settings at the same time share one encode
+        :return: (seq, jpg_bytes), jpg_bytes is None if nothing was published yet
+        '''
+        key = (quality, scale)
+        owner = False
+        with self.lock:
+            seq, frame = self.seq, self.frame
+            jpg_bytes = self.encodes.get(key)
+            if jpg_bytes is None and frame is not None:
+                future = self.pending.get(key)
+                if future is None:
+                    future = self.pending[key] = Future()
+                    owner = True
+        if jpg_bytes is not None or frame is None:
+            return seq, jpg_bytes
+        if not owner:
+            return seq, future.result()
+        try:
+            jpg_bytes = encode(frame, quality, scale)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                if self.seq == seq:
+                    self.pending.pop(key, None)
+                    if jpg_bytes is not None:
+                        self.encodes[key] = jpg_bytes
+        future.set_result(jpg_bytes)
+        return seq, jpg_bytes
+
+    def snapshot(self):
+        '''
+        get the latest frame in snapshot quality, encoded at most once per frame
+        :return: jpg_bytes or None
+        '''
+        return self.encoded(snapshot_quality)[1]
+
+broadcaster = FrameBroadcaster()
+
+def publish(img):
+    broadcaster.publish(img)
+
+class MjpgServer:
+    '''
+    mjpg stream and snapshot server, all clients are served from one asyncio event loop
+    '''
+    def __init__(self, host='', port=8080):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.frame_event = None
+        self.clients = 0
+        self.bytes_sent = 0
+        self.bytes_per_sec = 0.0
+        self.controllers = set()
+
+    def notify(self):
+        # runs in the event loop, wake every client waiting for a frame
+        self.frame_event.set()
+        self.frame_event = asyncio.Event()
+
+    def on_publish(self):
+        # runs in the publishing thread
+        self.loop.call_soon_threadsafe(self.notify)
+
+    def getStats(self):
+        return {'clients': self.clients,
+                'bytes_sent': self.bytes_sent,
+                'bytes_per_sec': self.bytes_per_sec,
+                'frame_seq': broadcaster.seq,
+                'streams': [c.settings() for c in self.controllers]}
+
+    async def measure(self):
+        last_bytes = self.bytes_sent
+        last_time = self.loop.time()
+        while True:
+            await asyncio.sleep(1)
+            now = self.loop.time()
+            self.bytes_per_sec = (self.bytes_sent - last_bytes) / (now - last_time)
+            last_bytes, last_time = self.bytes_sent, now
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while True:  # headers are not used
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b'\r\n', b'\n', b''):
                     break
+            request = request_line.decode('latin-1').split()
+            query = parse_qs(urlsplit(request[1] if len(request) > 1 else '/').query)
+            action = query.get('action', ['stream'])[0]
+            if action == 'snapshot':
+                await self.send_snapshot(writer)
+            elif action == 'stats':
+                await self.send_stats(writer)
+            else:
+                # e.g. /?action=stream&kbps=800&fps=10
+                kbps = float(query['kbps'][0]) if 'kbps' in query else stream_kbps
+                fps = float(query['fps'][0]) if 'fps' in query else 1.0 / stream_interval
+                controller = RateController(target_kbps=kbps, target_fps=fps, max_quality=stream_quality)
+                await self.send_stream(reader, writer, controller)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            print(e, "EE")
+        finally:
+            writer.close()
+
+    async def send_snapshot(self, writer):
+        jpg_bytes = await self.loop.run_in_executor(None, broadcaster.snapshot)
+        if jpg_bytes is None:
+            writer.write(b'HTTP/1.0 503 Service Unavailable\r\nContent-length: 0\r\n\r\n')
+        else:
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-type: image/jpeg\r\nContent-length: %d\r\n\r\n' % len(jpg_bytes))
+            writer.write(jpg_bytes)
+            self.bytes_sent += len(jpg_bytes)
+        await writer.drain()
+
+    async def send_stats(self, writer):
+        body = ''.join('%s %s\n' % (k, v) for k, v in self.getStats().items()).encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-type: text/plain\r\nContent-length: %d\r\n\r\n' % len(body))
+        writer.write(body)
+        await writer.drain()
+
+    async def send_stream(self, reader, writer, controller):
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-type: multipart/x-mixed-replace; boundary=--boundarydonotcross\r\n\r\n')
+        # the client never sends anything else, so a finished read means it has gone away
+        closed = asyncio.ensure_future(reader.read())
+        self.clients += 1
+        self.controllers.add(controller)
+        broadcaster.clients += 1
+        subscribed = None  # the settings publish() encodes for this client
+        try:
+            # start with the current frame, so that a client connecting while the camera is not producing
+            # frames (e.g. during the loading picture, which is published only once) still gets a picture
+            seq = broadcaster.seq - 1 if broadcaster.frame is not None else broadcaster.seq
+            while not closed.done():
+                t_start = self.loop.time()
+                if broadcaster.seq <= seq:
+                    frame = asyncio.ensure_future(self.frame_event.wait())
+                    await asyncio.wait((frame, closed), return_when=asyncio.FIRST_COMPLETED)
+                    frame.cancel()
+                    continue
+                if not controller.should_send():
+                    seq = broadcaster.seq
+                    continue
+                settings = (controller.quality, controller.scale)
+                if settings != subscribed:
+                    broadcaster.subscribe(settings, subscribed)
+                    subscribed = settings
+                if broadcaster.ready(*settings):
+                    seq, jpg_bytes = broadcaster.encoded(*settings)
+                else:
+                    seq, jpg_bytes = await self.loop.run_in_executor(None, broadcaster.encoded, *settings)
+                t_send = self.loop.time()
+                writer.write(b'--boundarydonotcross\r\nContent-type: image/jpeg\r\nContent-length: %d\r\n\r\n' % len(jpg_bytes))
+                writer.write(jpg_bytes)
+                # a slow client blocks here while newer frames replace the skipped ones
+                await writer.drain()
+                self.bytes_sent += len(jpg_bytes)
+                controller.update(len(jpg_bytes), self.loop.time() - t_send)
+                # pace this client, frames published meanwhile are skipped
+                t_wait = 1.0 / controller.target_fps - (self.loop.time() - t_start)
+                if t_wait > 0:
+                    await asyncio.sleep(t_wait)
+        finally:
+            closed.cancel()
+            self.clients -= 1
+            self.controllers.discard(controller)
+            broadcaster.clients -= 1
+            if subscribed is not None:
+                broadcaster.unsubscribe(subscribed)
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Handle requests in a separate thread."""
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.frame_event = asyncio.Event()
+        broadcaster.listeners.append(self.on_publish)
+        server = await asyncio.start_server(self.handle, self.host or None, self.port)
+        print("server started")
+        self.loop.create_task(self.measure())
+        async with server:
+            await server.serve_forever()
+
+server = MjpgServer()
 
+def getStats():
+    return server.getStats()
 
 def startMjpgServer():
     try:
-        server = ThreadedHTTPServer(('', 8080), MJPG_Handler)
-        #server = ThreadingHTTPServer(('', 8080), MJPG_Handler)
-        print("server started")
-        server.serve_forever()
+        asyncio.run(server.serve())
     except KeyboardInterrupt:
         pass
@@ -4,10 +4,14 @@ import os
 import sys
 sys.path.append('/home/pi/ArmPi/')
 import time
+import json
+import queue
 import logging
+import asyncio
+import functools
+import collections
 import threading
-from werkzeug.wrappers import Request, Response
-from werkzeug.serving import run_simple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from jsonrpc import JSONRPCResponseManager, dispatcher
 from ArmIK.ArmMoveIK import *
 import HiwonderSDK as hwsdk
@@ -31,10 +35,159 @@ __RPC_E05 = "E05 - Not callable"
 
 HWSONAR = None
 QUEUE = None
+MAINTH_TIMEOUT = 2.0  # seconds a caller waits for the main thread
+MAINTH_STATS = {}  # function name -> queue wait and execution time of the calls run by the main thread
+
+# while a JSON-RPC batch is handled, bus servo writes are collected here and sent together afterwards
+servo_batch = threading.local()
+
+# kinds of rpc methods
+EXCLUSIVE = 'exclusive'    # uses a hardware resource, calls wait for each other instead of colliding
+READONLY = 'readonly'      # answered from cached telemetry
+MAINTHREAD = 'mainthread'  # executed by the main thread through runbymainth
+CONCURRENT = 'concurrent'  # may run at any time, e.g. to stop what an exclusive call started
+METHOD_KINDS = {}
+METHOD_RESOURCES = {}  # method name -> the lock an EXCLUSIVE method holds
+LOCKS = {'bus_servo': threading.RLock(), 'i2c': threading.RLock()}
+
+WORKERS = ThreadPoolExecutor(max_workers=4)  # executes the rpc calls of the http server that fit no other pool
+# exclusive calls queue up per resource here, so that calls waiting for a resource (e.g. while an action
+# group holds the bus servos) do not take up the workers
+RESOURCE_WORKERS = {name: ThreadPoolExecutor(max_workers=1) for name in LOCKS}
+# concurrent and readonly calls never wait for a resource, they run here so that e.g. StopBusServo is
+# never queued behind calls that are waiting
+CONTROL_WORKERS = ThreadPoolExecutor(max_workers=4)
+ACTION_WORKER = ThreadPoolExecutor(max_workers=1)  # action groups queue up here and run one after another
+action_futures = []
+
+TELEMETRY_INTERVAL = 1.0  # seconds between two telemetry reads
+TELEMETRY_MAX_AGE = 5.0  # older cached values are reported as an error instead of being returned
+telemetry = {}  # name -> (time, value)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)  # seconds, upper bounds of the histogram
+SLOW_CALL_THRESHOLD = 0.1  # calls taking longer are kept in SLOW_CALLS
+SLOW_CALLS = collections.deque(maxlen=50)  # (time, method, duration, arguments) of the recent slow calls
+METHOD_STATS = {}  # method name -> call and error counts, latency histogram
+stats_lock = threading.Lock()
+
+def recordCall(name, duration, error, args):
+    with stats_lock:
+        stats = METHOD_STATS.get(name)
+        if stats is None:
+            stats = METHOD_STATS[name] = {'calls': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0,
+                                          'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+        i = 0
+        while i < len(LATENCY_BUCKETS) and duration > LATENCY_BUCKETS[i]:
+            i += 1
+        stats['buckets'][i] += 1
+        if duration >= SLOW_CALL_THRESHOLD:
+            summary = repr(args)
+            if len(summary) > 80:
+                summary = summary[:77] + '...'
+            SLOW_CALLS.append((time.time(), name, duration, summary))
+
+def getStats():
+    with stats_lock:
+        methods = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in METHOD_STATS.items()}
+        slow_calls = sorted(SLOW_CALLS, key=lambda c: c[2], reverse=True)
+    return {'methods': methods,
+            'latency_buckets': LATENCY_BUCKETS,
+            'slow_calls': [{'time': t, 'method': m, 'duration': d, 'args': a} for t, m, d, a in slow_calls],
+            'mainthread': {name: dict(stats) for name, stats in list(MAINTH_STATS.items())}}
+
+def getMetricsText():
+    '''
+    the method statistics in the prometheus text format
+    '''
+    lines = []
+    stats = getStats()
+    for name, m in sorted(stats['methods'].items()):
+        lines.append('rpc_calls_total{method="%s"} %d' % (name, m['calls']))
+        lines.append('rpc_errors_total{method="%s"} %d' % (name, m['errors']))
+        count = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), m['buckets']):
+            count += n
+            lines.append('rpc_latency_seconds_bucket{method="%s",le="%s"} %d' % (name, bound, count))
+        lines.append('rpc_latency_seconds_sum{method="%s"} %f' % (name, m['total_time']))
+        lines.append('rpc_latency_seconds_count{method="%s"} %d' % (name, m['calls']))
+    for name, m in sorted(stats['mainthread'].items()):
+        lines.append('rpc_mainthread_queue_wait_seconds_sum{function="%s"} %f' % (name, m['queue_wait']))
+        lines.append('rpc_mainthread_exec_seconds_sum{function="%s"} %f' % (name, m['exec_time']))
+        lines.append('rpc_mainthread_calls_total{function="%s"} %d' % (name, m['calls']))
+    return '\n'.join(lines) + '\n'
+
+def rpc_method(kind, resource='bus_servo'):
+    '''
+    register an rpc method and declare how it may run, calls are counted and timed
+    :param kind: EXCLUSIVE, READONLY, MAINTHREAD or CONCURRENT
+    :param resource: the lock an EXCLUSIVE method holds while it runs
+    '''
+    def decorator(f):
+        METHOD_KINDS[f.__name__] = kind
+        METHOD_RESOURCES[f.__name__] = resource if kind == EXCLUSIVE else None
+        lock = LOCKS[resource] if kind == EXCLUSIVE else None
+        @functools.wraps(f)
+        def method(*args, **kwargs):
+            t_start = time.monotonic()
+            error = True
+            try:
+                if lock is None:
+                    ret = f(*args, **kwargs)
+                else:
+                    with lock:
+                        ret = f(*args, **kwargs)
+                # the methods report failures as (False, error message)
+                error = isinstance(ret, tuple) and len(ret) > 0 and ret[0] is False
+                return ret
+            finally:
+                recordCall(f.__name__, time.monotonic() - t_start, error, args)
+        dispatcher.add_method(method)
+        return f
+    return decorator
+
+def readTelemetry(name):
+    '''
+    get a cached telemetry value, without touching the hardware, so that readonly calls never wait for a lock
+    :param name: telemetry name, e.g. 'battery'
+    :return: (True, value), or (False, error message) if there is no value younger than TELEMETRY_MAX_AGE
+    '''
+    cached = telemetry.get(name)
+    if cached is None:
+        return (False, __RPC_E04 + ' no %s reading yet' % name)
+    age = time.monotonic() - cached[0]
+    if age >= TELEMETRY_MAX_AGE:
+        return (False, __RPC_E04 + ' last %s reading is %.1f s old' % (name, age))
+    return (True, cached[1])
+
+def telemetryTask():
+    while True:
+        try:
+            with LOCKS['i2c']:
+                telemetry['battery'] = (time.monotonic(), Board.getBattery())
+                if HWSONAR is not None:
+                    telemetry['sonar'] = (time.monotonic(), HWSONAR.getDistance())
+        except Exception as e:
+            print(e)
+        time.sleep(TELEMETRY_INTERVAL)
+
+def runActionExclusive(actNum):
+    with LOCKS['bus_servo']:
+        AGC.runAction(actNum)
 
 initMove()
 
-@dispatcher.add_method
+def setBusServoPulse(servo, pulse, use_time):
+    pending = getattr(servo_batch, 'pending', None)
+    if pending is None:
+        Board.setBusServoPulse(servo, pulse, use_time)
+    else:
+        pending[servo] = (pulse, use_time)  # a later write to the same servo replaces the earlier one
+
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetPWMServo(*args, **kwargs):
     ret = (True, ())
     arglen = len(args)
@@ -55,7 +208,7 @@ def SetPWMServo(*args, **kwargs):
         ret = (False, __RPC_E03)
     return ret
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def SetBusServoPulse(*args, **kwargs):
     ret = (True, ())
     arglen = len(args)
@@ -70,13 +223,13 @@ def SetBusServoPulse(*args, **kwargs):
                 return (False, __RPC_E02)
         dat = zip(servos, pulses)
         for (s, p) in dat:
-            Board.setBusServoPulse(s, p, use_times)
+            setBusServoPulse(s, p, use_times)
     except Exception as e:
         print(e)
         ret = (False, __RPC_E03)
-    #return ret
+    return ret
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def SetBusServoDeviation(*args):
     ret = (True, ())
     arglen = len(args)
@@ -89,8 +242,9 @@ def SetBusServoDeviation(*args):
     except Exception as e:
         print(e)
         ret = (False, __RPC_E03)
+    return ret
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def GetBusServosDeviation(args):
     ret = (True, ())
     data = []
@@ -108,7 +262,7 @@ def GetBusServosDeviation(args):
         ret = (False, __RPC_E03)
     return ret 
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def SaveBusServosDeviation(args):
     ret = (True, ())
     if args != "downloadDeviation":
@@ -121,7 +275,7 @@ def SaveBusServosDeviation(args):
         ret = (False, __RPC_E03)
     return ret 
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def UnloadBusServo(args):
     ret = (True, ())
     if args != 'servoPowerDown':
@@ -132,8 +286,9 @@ def UnloadBusServo(args):
     except Exception as e:
         print(e)
         ret = (False, __RPC_E03)
+    return ret
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE)
 def GetBusServosPulse(args):
     ret = (True, ())
     data = []
@@ -153,29 +308,35 @@ def GetBusServosPulse(args):
         ret = (False, __RPC_E03)
     return ret 
 
-@dispatcher.add_method
+@rpc_method(CONCURRENT)
 def StopBusServo(args):
     ret = (True, ())
     if args != 'stopAction':
         return (False, __RPC_E01)
     try:     
+        # drop the queued action groups, then stop the running one
+        for f in action_futures:
+            f.cancel()
         AGC.stop_action_group()
     except Exception as e:
         print(e)
         ret = (False, __RPC_E03)
+    return ret
 
-@dispatcher.add_method
+@rpc_method(CONCURRENT)
 def RunAction(args):
     ret = (True, ())
     if len(args) == 0:
         return (False, __RPC_E01)
     try:
-        threading.Thread(target=AGC.runAction, args=(args, )).start()
+        action_futures[:] = [f for f in action_futures if not f.done()]
+        action_futures.append(ACTION_WORKER.submit(runActionExclusive, args))
     except Exception as e:
         print(e)
         ret = (False, __RPC_E03)
-        
-@dispatcher.add_method
+    return ret
+
+@rpc_method(EXCLUSIVE)
 def ArmMoveIk(*args):   
     ret = (True, ())
     if len(args) != 7:
@@ -188,7 +349,7 @@ def ArmMoveIk(*args):
         ret = (False, __RPC_E03)
     return ret
         
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetBrushMotor(*args, **kwargs):
     ret = (True, ())
     arglen = len(args)
@@ -208,33 +369,22 @@ def SetBrushMotor(*args, **kwargs):
         ret = (False, __RPC_E03)
     return ret
 
-@dispatcher.add_method
+@rpc_method(READONLY)
 def GetSonarDistance():
     global HWSONAR
-    ret = (True, 0)
-    try:
-        ret = (True, HWSONAR.getDistance())
-    except:
-        ret = (False, __RPC_E03)
-    return ret
+    return readTelemetry('sonar')
 
-@dispatcher.add_method
+@rpc_method(READONLY)
 def GetBatteryVoltage():
-    ret = (True, 0)
-    try:
-        ret = (True, Board.getBattery())
-    except Exception as e:
-        print(e)
-        ret = (False, __RPC_E03)
-    return ret
+    return readTelemetry('battery')
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetSonarRGBMode(mode = 0):
     global HWSONAR
     HWSONAR.setRGBMode(mode)
     return (True, (mode,))
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetSonarRGB(index, r, g, b):
     global HWSONAR
     if index == 0:
@@ -244,13 +394,13 @@ def SetSonarRGB(index, r, g, b):
         HWSONAR.setRGB(index, (r, g, b))
     return (True, (r, g, b))
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetSonarRGBBreathCycle(index, color, cycle):
     global HWSONAR
     HWSONAR.setBreathCycle(index, color, cycle)
     return (True, (index, color, cycle))
 
-@dispatcher.add_method
+@rpc_method(EXCLUSIVE, 'i2c')
 def SetSonarRGBStartSymphony():
     global HWSONAR
     HWSONAR.startSymphony()
@@ -258,88 +408,273 @@ def SetSonarRGBStartSymphony():
 
 def runbymainth(req, pas):
     if callable(req):
-        event = threading.Event()
-        ret = [event, pas, None]
-        QUEUE.put((req, ret))
-        count = 0
-        #ret[2] =  req(pas)
-        #print('ret', ret)
-        while ret[2] is None:
-            time.sleep(0.01)
-            count += 1
-            if count > 200:
-                break
-        if ret[2] is not None:
-            if ret[2][0]:
-                return ret[2]
-            else:
-                return (False, __RPC_E03 + " " + ret[2][1])
-        else:
+        future = Future()
+        QUEUE.put((req, pas, future, time.monotonic()))
+        try:
+            ret = future.result(timeout=MAINTH_TIMEOUT)
+        except FutureTimeout:
+            # drop the request if the main thread has not started it yet
+            future.cancel()
             return (False, __RPC_E04)
+        except Exception as e:
+            return (False, __RPC_E03 + " " + str(e))
+        if ret[0]:
+            return ret
+        else:
+            return (False, __RPC_E03 + " " + ret[1])
     else:
         return (False, __RPC_E05)
 
-@dispatcher.add_method
+def runMainThreadQueue(timeout):
+    """
+    execute the requests queued by runbymainth, must be called from the main thread
+    :param timeout: keep waiting for requests this long, each one is executed as soon as it arrives
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                req, params, future, t_put = QUEUE.get(timeout=remaining)
+            else:
+                req, params, future, t_put = QUEUE.get(False)
+        except queue.Empty:
+            break
+        if not future.set_running_or_notify_cancel():
+            continue  # the caller timed out
+        t_start = time.monotonic()
+        try:
+            future.set_result(req(params))  # executive RPC command
+        except Exception as e:
+            future.set_exception(e)
+        t_end = time.monotonic()
+
+        stats = MAINTH_STATS.setdefault(req.__name__, {'calls': 0, 'queue_wait': 0.0, 'max_queue_wait': 0.0,
+                                                       'exec_time': 0.0, 'max_exec_time': 0.0})
+        stats['calls'] += 1
+        stats['queue_wait'] += t_start - t_put
+        stats['max_queue_wait'] = max(stats['max_queue_wait'], t_start - t_put)
+        stats['exec_time'] += t_end - t_start
+        stats['max_exec_time'] = max(stats['max_exec_time'], t_end - t_start)
+
+@rpc_method(MAINTHREAD)
 def SetSonarDistanceThreshold(new_threshold = 30): 
     return runbymainth(Avoidance.setThreshold, (new_threshold,))
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def GetSonarDistanceThreshold():
     return runbymainth(Avoidance.getThreshold, ())
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def LoadFunc(new_func = 0):
     return runbymainth(Running.loadFunc, (new_func, ))
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def UnloadFunc():
     return runbymainth(Running.unloadFunc, ())
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def StartFunc():
     return runbymainth(Running.startFunc, ())
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def StopFunc():
     return runbymainth(Running.stopFunc, ())
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def FinishFunc():
     return runbymainth(Running.finishFunc, ())
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def Heartbeat():
     return runbymainth(Running.doHeartbeat, ())
 
-@dispatcher.add_method
+@rpc_method(READONLY)
 def GetRunningFunc():
     #return runbymainth("GetRunningFunc", ())
     return (True, (0,))
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def ColorTracking(*target_color):
     return runbymainth(ColorTrack.setTargetColor, target_color)
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def ColorSorting(*target_color):
     return runbymainth(ColorSort.setTargetColor, target_color)
 
-@dispatcher.add_method
+@rpc_method(MAINTHREAD)
 def ColorPalletizing(*target_color):
     return runbymainth(ColorPalletiz.setTargetColor, target_color)
 
-@Request.application
-def application(request):
-    dispatcher["echo"] = lambda s: s
-    dispatcher["add"] = lambda a, b: a + b
-    #print(request.data)
-    response = JSONRPCResponseManager.handle(request.data, dispatcher)
-    return Response(response.json, mimetype='application/json')
+def flushServoBatch():
+    '''
+    send the bus servo writes collected so far in the current batch
+    :return: None, or (False, error message) if the write failed
+    '''
+    pending = servo_batch.pending
+    servo_batch.pending = {}
+    if not pending:
+        return None
+    try:
+        with LOCKS['bus_servo']:
+            Board.setBusServosPulse([(s, p, t) for s, (p, t) in pending.items()])
+    except Exception as e:
+        print(e)
+        return (False, __RPC_E03 + ' ' + str(e))
+    return None
+
+def handle(data):
+    '''
+    handle a JSON-RPC request or a batch of requests
+    the calls of a batch run in order, consecutive bus servo writes are coalesced into one serial write that
+    is sent before the next other call, or at the end of the batch
+    if that write fails, the coalesced calls and the call that was about to run report the failure
+    :param data: request body
+    :return: response json, empty if there is nothing to answer (notifications only)
+    '''
+    try:
+        calls = json.loads(data)
+    except ValueError:
+        calls = None
+    if not isinstance(calls, list) or not calls:
+        response = JSONRPCResponseManager.handle(data, dispatcher)
+        return response.json if response is not None else ''
+    # each call of the batch takes the locks it needs itself, so that e.g. a main thread call in the
+    # batch does not hold the bus servos while it waits, only the coalesced write takes the bus servo line
+    responses = []
+    deferred = []  # (index in responses, id) of the calls whose writes are still pending
+    def failDeferred(ret):
+        for i, call_id in deferred:
+            responses[i] = json.dumps({'jsonrpc': '2.0', 'id': call_id, 'result': list(ret)})
+    servo_batch.pending = {}
+    try:
+        for call in calls:
+            method = call.get('method') if isinstance(call, dict) else None
+            if method != 'SetBusServoPulse' and servo_batch.pending:
+                ret = flushServoBatch()
+                if ret is not None:
+                    failDeferred(ret)
+                    deferred = []
+                    if isinstance(call, dict) and 'id' in call:
+                        recordCall(method, 0.0, True, call.get('params'))
+                        responses.append(json.dumps({'jsonrpc': '2.0', 'id': call['id'], 'result': list(ret)}))
+                    continue
+                deferred = []
+            response = JSONRPCResponseManager.handle(json.dumps(call), dispatcher)
+            if response is None:
+                continue
+            responses.append(response.json)
+            if method == 'SetBusServoPulse':
+                deferred.append((len(responses) - 1, call.get('id')))
+        ret = flushServoBatch()
+        if ret is not None:
+            failDeferred(ret)
+    finally:
+        servo_batch.pending = None
+    return '[' + ', '.join(responses) + ']' if responses else ''
+
+def chooseWorkers(data):
+    '''
+    pick the pool a request runs in from the kinds of the methods it calls
+    :param data: request body
+    '''
+    try:
+        calls = json.loads(data)
+    except ValueError:
+        return WORKERS
+    if not isinstance(calls, list):
+        calls = [calls]
+    names = [call.get('method') for call in calls if isinstance(call, dict)]
+    kinds = set(METHOD_KINDS.get(name) for name in names)
+    if names and kinds <= {CONCURRENT, READONLY}:
+        return CONTROL_WORKERS
+    resources = set(METHOD_RESOURCES[name] for name in names if METHOD_KINDS.get(name) == EXCLUSIVE)
+    if kinds <= {EXCLUSIVE, CONCURRENT, READONLY} and len(resources) == 1:
+        return RESOURCE_WORKERS[resources.pop()]
+    return WORKERS
+
+@rpc_method(CONCURRENT)
+def GetStats():
+    return (True, getStats())
+
+dispatcher["echo"] = lambda s: s
+dispatcher["add"] = lambda a, b: a + b
+
+async def serveHttp(reader, writer):
+    '''
+    JSON-RPC over HTTP/1.1, the connection is kept open between calls unless the client closes it
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            data = await reader.readexactly(int(headers.get('content-length', 0)))
+            keep_alive = request_line.rstrip().endswith(b'HTTP/1.1') and headers.get('connection', '').lower() != 'close'
+
+            if request_line.startswith(b'GET /metrics'):
+                body = getMetricsText().encode()
+                content_type = b'text/plain; version=0.0.4'
+            else:
+                body = (await loop.run_in_executor(chooseWorkers(data), handle, data)).encode()
+                content_type = b'application/json'
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n' % (content_type, len(body)))
+            writer.write(b'Connection: keep-alive\r\n\r\n' if keep_alive else b'Connection: close\r\n\r\n')
+            writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        print(e)
+    finally:
+        writer.close()
+
+async def serveRPC(port):
+    server = await asyncio.start_server(serveHttp, None, port)
+    async with server:
+        await server.serve_forever()
 
 def startRPCServer():
-#    log = logging.getLogger('werkzeug')
-#    log.setLevel(logging.ERROR)
-    run_simple('', 9030, application)
+    threading.Thread(target=telemetryTask, daemon=True).start()
+    asyncio.run(serveRPC(9030))
+
+async def serveZmqRPC(port):
+    '''
+    JSON-RPC over a ZeroMQ ROUTER socket, for clients that stream commands over one connection
+    accepts REQ clients as well as DEALER clients that pipeline several requests, the requests run in the
+    same pools as the http ones, so the answers to pipelined requests may come back out of order
+    '''
+    import zmq
+    import zmq.asyncio
+    loop = asyncio.get_running_loop()
+    socket = zmq.asyncio.Context.instance().socket(zmq.ROUTER)
+    socket.bind("tcp://*:%d" % port)
+
+    async def reply(envelope, data):
+        try:
+            response = await loop.run_in_executor(chooseWorkers(data), handle, data)
+        except Exception as e:
+            print(e)
+            response = ''
+        await socket.send_multipart(envelope + [response.encode()])
+
+    while True:
+        frames = await socket.recv_multipart()
+        envelope, data = frames[:-1], frames[-1]  # routing id (and empty delimiter for REQ)
+        loop.create_task(reply(envelope, data))
+
+def startZmqRPCServer(port=9031):
+    asyncio.run(serveZmqRPC(port))
 
 if __name__ == '__main__':
     startRPCServer()
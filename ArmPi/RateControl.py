@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# coding=utf8
+import sys
+import time
+
+if sys.version_info.major == 2:
+    print('Please run this program with python3!')
+    sys.exit(0)
+
+class RateController:
+    '''
+    picks jpeg quality, resolution and frame skipping for one video stream
+
+    The controller targets a bitrate (target_kbps) and/or a frame rate (target_fps).
+    After every sent frame call update() with the encoded size and the time the send
+    took (None if the send does not block, e.g. a zmq PUB socket, so that its duration
+    says nothing about congestion). Call feedback() whenever the receiver reports how
+    many of the frames sent over a period it actually got. Settings are stepped down in
+    the order quality, resolution, frame skipping and stepped back up in the reverse order.
+    '''
+
+    QUALITY_STEP = 10
+    SCALES = (1.0, 0.75, 0.5, 0.25)
+    MAX_SKIP = 4
+
+    def __init__(self, target_kbps=None, target_fps=20, min_quality=30, max_quality=90, adjust_interval=1.0):
+        self.target_kbps = target_kbps
+        self.target_fps = target_fps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.adjust_interval = adjust_interval
+
+        self.quality = max_quality
+        self.scale_index = 0
+        self.skip = 0
+        self.skipped = 0
+
+        # exponential moving averages of the measurements
+        self.avg_bytes = 0.0
+        self.avg_send_time = 0.0
+        self.send_times = 0  # frames whose send time was measured
+        self.loss = 0.0
+        self.frames = 0
+        self.last_adjust = time.monotonic()
+
+    @property
+    def scale(self):
+        return self.SCALES[self.scale_index]
+
+    def should_send(self):
+        '''Frame skipping, call once per available frame'''
+        if self.skipped < self.skip:
+            self.skipped += 1
+            return False
+        self.skipped = 0
+        return True
+
+    def update(self, nbytes, send_time):
+        '''Record one sent frame
+        :param nbytes: encoded frame size
+        :param send_time: seconds spent sending the frame, None if not measured
+        '''
+        alpha = 0.2
+        if self.frames == 0:
+            self.avg_bytes = nbytes
+        else:
+            self.avg_bytes += alpha * (nbytes - self.avg_bytes)
+        if send_time is not None:
+            if self.send_times == 0:
+                self.avg_send_time = send_time
+            else:
+                self.avg_send_time += alpha * (send_time - self.avg_send_time)
+            self.send_times += 1
+        self.frames += 1
+        self.adjust()
+
+    def feedback(self, received, sent):
+        '''Record a receiver report
+        :param received: frames the receiver got out of the sent ones
+        :param sent: frames sent over the period the receiver counted
+        '''
+        if sent > 0:
+            loss = max(0.0, 1.0 - float(received) / sent)
+            self.loss += 0.5 * (loss - self.loss)
+
+    def adjust(self):
+        now = time.monotonic()
+        if now - self.last_adjust < self.adjust_interval:
+            return
+        self.last_adjust = now
+
+        fps = float(self.target_fps) / (self.skip + 1)
+        period = 1.0 / self.target_fps
+        pressure = 0  # > 0: the stream is too expensive, < 0: there is headroom
+        if self.target_kbps is not None:
+            kbps = self.avg_bytes * 8 * fps / 1000.0
+            if kbps > self.target_kbps * 1.1:
+                pressure = 1
+            elif kbps < self.target_kbps * 0.7:
+                pressure = -1
+        # without send times only the receiver's loss reports show congestion
+        send_time = self.avg_send_time if self.send_times else 0.0
+        if send_time > period or self.loss > 0.1:
+            pressure = 1
+        elif pressure == 0 and send_time < period * 0.5 and self.loss < 0.02:
+            pressure = -1
+
+        if pressure > 0:
+            self.decrease()
+        elif pressure < 0:
+            self.increase()
+
+    def decrease(self):
+        if self.quality - self.QUALITY_STEP >= self.min_quality:
+            self.quality -= self.QUALITY_STEP
+        elif self.scale_index < len(self.SCALES) - 1:
+            self.scale_index += 1
+        elif self.skip < self.MAX_SKIP:
+            self.skip += 1
+
+    def increase(self):
+        if self.skip > 0:
+            self.skip -= 1
+        elif self.scale_index > 0:
+            self.scale_index -= 1
+        elif self.quality + self.QUALITY_STEP <= self.max_quality:
+            self.quality += self.QUALITY_STEP
+
+    def settings(self):
+        '''Currently chosen settings and the measurements they are based on'''
+        return {'quality': self.quality,
+                'scale': self.scale,
+                'skip': self.skip,
+                'avg_bytes': int(self.avg_bytes),
+                'avg_send_time': round(self.avg_send_time, 4),
+                'loss': round(self.loss, 3)}
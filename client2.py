@@ -9,10 +9,9 @@ import cv2 as cv
 
 def demogrify(topicmsg):
     """Inverse of mogrify()"""
-    json0 = topicmsg.find("[")
-    topic = topicmsg[0:json0].strip()
-    msg = json.loads(topicmsg[json0:])
-    return topic, msg
+    topic, rest = topicmsg.split(b" ", 1)
+    header, payload = rest.split(b"\n", 1)
+    return topic.decode("utf-8"), json.loads(header), payload
 
 
 # Set the port
@@ -21,29 +20,74 @@ if len(sys.argv) > 1:
     port = sys.argv[1]
     int(port)
 
+host = "192.168.31.5"  # I hope this IP is constant, otherwise change it to your laptop's IP
+
 # Socket to talk to server
 context = zmq.Context()
 socket = context.socket(zmq.SUB)
 socket.setsockopt(zmq.CONFLATE, 1)  # Take only the last element
-socket.connect(
-    "tcp://192.168.31.5:%s" % port
-)  # I hope this IP is constant, otherwise change it to your laptop's IP
+socket.connect("tcp://%s:%s" % (host, port))
+
+# Socket to report the received frame count back to the server's rate controller
+feedback = context.socket(zmq.PUSH)
+feedback.setsockopt(zmq.SNDHWM, 1)
+feedback.connect("tcp://%s:%d" % (host, int(port) + 1))
 
 # Set topic filter
 topicfilter = "perception"  # This should match the server's topic name
 socket.setsockopt(zmq.SUBSCRIBE, bytes(topicfilter, "utf-8"))
 
-while True:
-    time.sleep(0.5)
-    try:
-        res = socket.recv(flags=zmq.NOBLOCK)  # Asynchronous communication using noblock
-        topic, message = demogrify(res.decode("utf-8"))
-        print("client receives: image at the topic: " + topic)
-        img = cv.imdecode(np.asarray(message, dtype="uint8"), cv.IMREAD_COLOR)
-        cv.imshow("img", img)
+received = 0  # frames received with a seq after reported_seq
+reported_seq = None  # last seq covered by the previous report
+last_seq = None
+last_report = time.monotonic()
+keyframe = None  # last keyframe, delta frames are composited onto it
+key_seq = 0
 
-        cv.waitKey(1)
+while True:
+    if time.monotonic() - last_report > 1.0:
+        # Report the seq range the count covers, so that the server compares it with the frames it sent in that range
+        if last_seq is not None and last_seq > reported_seq:
+            try:
+                feedback.send(bytes(json.dumps({"received": received, "after": reported_seq, "last": last_seq}),
+                                    "utf-8"), flags=zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+            received = 0
+            reported_seq = last_seq
+        last_report = time.monotonic()
 
-    except zmq.Again as e:
+    # Wait for the next frame instead of sleeping, so that frames are not dropped here
+    if socket.poll(500) == 0:
         # If not received, do something else
         print("No new message received yet")
+        continue
+
+    res = socket.recv()
+    topic, header, message = demogrify(res)
+    if reported_seq is None or header["seq"] <= reported_seq:
+        # First frame, or the server was restarted: start counting from this frame
+        reported_seq = header["seq"] - 1
+        received = 0
+    last_seq = header["seq"]
+    received += 1
+    print("client receives: image %d at the topic: %s (quality %d, scale %g)"
+          % (header["seq"], topic, header["quality"], header["scale"]))
+    if header.get("type") == "delta":
+        if keyframe is None or header["key"] != key_seq:
+            # The keyframe these tiles belong to was dropped, wait for the next one
+            continue
+        img = keyframe.copy()
+        offset = 0
+        for x, y, w, h, length in header["tiles"]:
+            tile = np.frombuffer(message, dtype="uint8", count=length, offset=offset)
+            img[y:y + h, x:x + w] = cv.imdecode(tile, cv.IMREAD_COLOR)
+            offset += length
+    else:
+        img = cv.imdecode(np.frombuffer(message, dtype="uint8"), cv.IMREAD_COLOR)
+        if header.get("type") == "key":
+            keyframe = img
+            key_seq = header["key"]
+    cv.imshow("img", img)
+
+    cv.waitKey(1)
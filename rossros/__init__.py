@@ -5,3 +5,4 @@ fpath = os.path.dirname(__file__)  # nopep8
 sys.path.append(fpath)  # nopep8
 
 from .rossros_asyncio import Bus, Consumer, ConsumerProducer, Producer, Printer, Timer, runConcurrently
+from .rossros_asyncio import ProfileReporter, enableProfiling, formatStats, offload, requestShutdown, stats
@@ -1,19 +1,207 @@
 #! /usr/bin/python3
-import concurrent.futures
+import collections
+import numpy as np
+import functools
+import sys
 import time
+import pickle
+import struct
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import threading
+import math
+import inspect
 import logging
 from readerwriterlock import rwlock
 from logdecorator import log_on_start, log_on_end, log_on_error
 
 DEBUG = logging.DEBUG
+logger = logging.getLogger(__name__)
 logging_format = "%(asctime)s: %(message)s"
 logging.basicConfig(format=logging_format, level=logging.INFO,
                     datefmt="%H:%M:%S")
 
+# Fast path: the logging decorators format their messages on every call, even when DEBUG
+# messages are not shown. With FAST_PATH on, each bus and consumer-producer checks the log level once
+# when it is constructed, and if DEBUG is off it calls the undecorated versions of its
+# per-loop methods. Set FAST_PATH to False (or enable DEBUG logging) before creating the
+# objects to get the per-call log messages back.
+FAST_PATH = True
+
+# Profiling: with PROFILE on, consumer-producers created afterwards time every pass through their
+# loop (see NodeProfile and stats). With PROFILE off they run without any timing code.
+PROFILE = False
+profiles = []  # NodeProfile of every profiled consumer-producer
+
+# Consumer-producers of the graphs that runConcurrently is currently running
+running_nodes = []
+
+
+def enableProfiling(enabled=True):
+    """
+    Function that turns profiling on (or off) for the consumer-producers created afterwards, in rossros
+    and in the modules built on it (such as rossros_asyncio)
+    """
+
+    # The modules that imported everything from rossros share its list of profiles
+    for module in list(sys.modules.values()):
+        if getattr(module, 'profiles', None) is profiles:
+            module.PROFILE = enabled
+
+
+def requestShutdown():
+    """
+    Function that stops every consumer-producer started by runConcurrently, waking them up from their
+    sleeps and trigger waits at once (e.g. from a signal handler or another thread)
+    """
+
+    for cp in list(running_nodes):
+        cp.stop()
+
+
+def moduleSetting(obj, setting_name, default):
+    """
+    Function that looks up a switch such as FAST_PATH in the module that defines the object's class,
+    so that setting it on rossros_asyncio works the same as setting it on rossros
+    """
+    return getattr(sys.modules.get(type(obj).__module__), setting_name, default)
+
+
+def resolveLogging(obj, method_names):
+    """
+    Function that replaces the logged methods of an object with their undecorated versions,
+    if DEBUG logging is off for the module that defines them
+    """
+
+    if not moduleSetting(obj, 'FAST_PATH', FAST_PATH):
+        return
+
+    for method_name in method_names:
+        method = getattr(type(obj), method_name)
+
+        # Leave the decorators in place if their messages would be shown
+        if logging.getLogger(method.__module__).isEnabledFor(DEBUG):
+            continue
+
+        # Strip the decorators and bind the plain function to this object only
+        setattr(obj, method_name, inspect.unwrap(method).__get__(obj))
+
+
+class NodeProfile:
+    """
+    Class for the timing statistics of one consumer-producer: how often its loop runs, how long its
+    function takes, how long it spends reading and writing buses (which includes waiting for bus locks),
+    and how old the input messages are when it reads them (staleness)
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.iterations = 0
+        self.first_pass = None
+        self.last_pass = None
+
+        self.function_time = 0.0
+        self.max_function_time = 0.0
+        self.bus_time = 0.0
+        self.max_bus_time = 0.0
+
+        self.staleness = 0.0
+        self.max_staleness = 0.0
+        self.staleness_samples = 0
+
+    def record(self, start, function_time, bus_time, staleness):
+
+        if self.first_pass is None:
+            self.first_pass = start
+        self.last_pass = start
+        self.iterations += 1
+
+        self.function_time += function_time
+        self.max_function_time = max(self.max_function_time, function_time)
+        self.bus_time += bus_time
+        self.max_bus_time = max(self.max_bus_time, bus_time)
+
+        # Staleness is unknown if none of the inputs has been written to yet
+        if staleness is not None:
+            self.staleness += staleness
+            self.max_staleness = max(self.max_staleness, staleness)
+            self.staleness_samples += 1
+
+    def summary(self):
+        """
+        Statistics as a dictionary, times in seconds
+        """
+
+        passes = max(self.iterations, 1)
+        elapsed = (self.last_pass - self.first_pass) if self.iterations > 1 else 0.0
+
+        return {"iterations": self.iterations,
+                "rate": (self.iterations - 1) / elapsed if elapsed > 0 else None,
+                "mean_function_time": self.function_time / passes,
+                "max_function_time": self.max_function_time,
+                "mean_bus_time": self.bus_time / passes,
+                "max_bus_time": self.max_bus_time,
+                "utilization": self.function_time / elapsed if elapsed > 0 else None,
+                "mean_staleness": self.staleness / self.staleness_samples if self.staleness_samples else None,
+                "max_staleness": self.max_staleness if self.staleness_samples else None}
+
+
+def stats():
+    """
+    Function that returns the statistics of every profiled consumer-producer, keyed by name.
+    Consumer-producers only collect statistics if PROFILE was on when they were created, and only for
+    the passes they ran in this process.
+    """
+
+    result = {}
+    for profile in profiles:
+
+        # Keep consumer-producers with the same name apart
+        name = profile.name
+        count = 1
+        while name in result:
+            count += 1
+            name = "{:s} ({:d})".format(profile.name, count)
+
+        result[name] = profile.summary()
+
+    return result
+
+
+def formatStats():
+    """
+    Function that formats the statistics of all profiled consumer-producers as a text table,
+    times in milliseconds
+    """
+
+    def ms(value):
+        return "-" if value is None else "{:.2f}".format(value * 1000)
+
+    lines = ["{:<30s}{:>8s}{:>9s}{:>10s}{:>10s}{:>9s}{:>7s}{:>11s}".format(
+        "node", "passes", "rate Hz", "func ms", "max ms", "bus ms", "util", "stale ms")]
+
+    for name, s in stats().items():
+        lines.append("{:<30s}{:>8d}{:>9s}{:>10s}{:>10s}{:>9s}{:>7s}{:>11s}".format(
+            name[:29],
+            s["iterations"],
+            "-" if s["rate"] is None else "{:.1f}".format(s["rate"]),
+            ms(s["mean_function_time"]),
+            ms(s["max_function_time"]),
+            ms(s["mean_bus_time"]),
+            "-" if s["utilization"] is None else "{:.0%}".format(s["utilization"]),
+            ms(s["mean_staleness"])))
+
+    return "\n".join(lines)
+
 
 class Bus:
     """
     Class for passing broadcast messages between processes.
+
+    Every write increases the bus version, and calls the functions that subscribed to the bus,
+    so that readers can wait for new messages instead of polling the bus.
     """
 
     def __init__(self,
@@ -26,6 +214,18 @@ class Bus:
         # Set up the class so that functions can get a lock while working
         self.lock = rwlock.RWLockFairD()
 
+        # Count the writes, note the time of the last one, and keep a list of functions to call after each write
+        self.version = 0
+        self.timestamp = None
+        self.listeners = []
+
+        # Condition for the wait method, only notified once something waited on it
+        self.condition = threading.Condition()
+        self.condition_subscribed = False
+
+        # Skip the logging decorators on reads and writes if DEBUG logging is off
+        resolveLogging(self, ('get_message', 'set_message'))
+
     @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
     @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
     @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
@@ -43,6 +243,594 @@ class Bus:
 
         with self.lock.gen_wlock():
             self.message = message
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    def subscribe(self, listener):
+        """
+        Register a function (taking no arguments) to be called after every write to the bus
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def notifyCondition(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def hasNewMessage(self, version):
+        """
+        Check whether the bus was written to after it had the given version
+        """
+        return self.version > version
+
+    def registerWriter(self, name):
+        """
+        Called by each consumer-producer that writes to the bus, when it is created. Any number of
+        writers is fine for a plain Bus.
+        """
+        pass
+
+    def interruptWriters(self, interrupt=True):
+        """
+        Called with True when a consumer-producer writing the bus is stopped, and with False when one
+        starts. A plain Bus never makes its writers wait.
+        """
+        pass
+
+    def wait(self, version, timeout=None):
+        """
+        Block until the bus holds a message newer than the given version, or until the timeout
+        (in seconds) runs out. Returns True if there is a newer message.
+        """
+
+        with self.condition:
+            if not self.condition_subscribed:
+                self.condition_subscribed = True
+                self.subscribe(self.notifyCondition)
+            return self.condition.wait_for(lambda: self.version > version, timeout)
+
+
+class QueueBus(Bus):
+    """
+    Bus that keeps every message in a bounded first-in-first-out queue, so that a slow consumer
+    sees all of the messages instead of only the latest one. Each get_message call takes the oldest
+    message out of the queue; if the queue is empty, it returns empty_message.
+
+    When the queue is full, the "drop_oldest" policy discards the oldest message to make room
+    (counting it in self.dropped), and the "block" policy makes set_message wait until a consumer
+    has taken a message. Only use "block" with the threaded rossros, as with asyncio nothing could
+    empty the queue while the writer waits. A waiting writer gives up (dropping its message) when
+    it is stopped, so that a graph whose consumer stopped first can still shut down.
+    """
+
+    def __init__(self,
+                 initial_message=None,  # first message in the queue, None for an empty queue
+                 name="Unnamed Queue Bus",
+                 maxsize=16,  # number of messages the queue can hold
+                 policy="drop_oldest",  # "drop_oldest" or "block", what set_message does when the queue is full
+                 empty_message=None):  # returned by get_message when the queue is empty
+
+        if policy not in ("drop_oldest", "block"):
+            raise ValueError("{:s}: unknown queue policy {}".format(name, policy))
+
+        super().__init__(empty_message, name)
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.empty_message = empty_message
+        self.dropped = 0
+
+        # The queue uses its own condition instead of the read-write lock, as every read also changes it
+        self.queue = collections.deque()
+        self.queue_condition = threading.Condition()
+        self.interrupted = False  # a writer was stopped, blocked writes give up
+
+        if initial_message is not None:
+            self.queue.append(initial_message)
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
+    def get_message(self, _name='Unspecified function'):
+
+        with self.queue_condition:
+            if not self.queue:
+                return self.empty_message
+            message = self.queue.popleft()
+
+            # Let a blocked writer continue
+            self.queue_condition.notify_all()
+
+        return message
+
+    def get_messages(self, _name='Unspecified function'):
+        """
+        Take all of the queued messages out of the queue at once, oldest first
+        """
+
+        with self.queue_condition:
+            messages = list(self.queue)
+            self.queue.clear()
+            self.queue_condition.notify_all()
+
+        return messages
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        with self.queue_condition:
+            if len(self.queue) >= self.maxsize:
+                if self.policy == "block":
+                    self.queue_condition.wait_for(lambda: len(self.queue) < self.maxsize or self.interrupted)
+                    if len(self.queue) >= self.maxsize:
+                        self.dropped += 1
+                        return
+                else:
+                    self.queue.popleft()
+                    self.dropped += 1
+
+            self.queue.append(message)
+            self.message = message
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    def interruptWriters(self, interrupt=True):
+
+        # Wake up a blocked writer so that it sees it was stopped
+        with self.queue_condition:
+            self.interrupted = interrupt
+            self.queue_condition.notify_all()
+
+    def hasNewMessage(self, version):
+        """
+        A queue has new messages for as long as it is not empty
+        """
+        return len(self.queue) > 0
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class SingleWriterBus(Bus):
+    """
+    Bus for exactly one writing consumer-producer, whose reads and writes take no lock.
+
+    A write swaps the bus's reference to the message, which is atomic in Python, so readers never
+    block and always get a whole message. The writer must not change a message object after writing
+    it (write a new object instead), since readers may still be using it.
+
+    For NumPy array messages that the writer keeps changing in place, seqlock=True copies each written
+    array into one of two buffers owned by the bus, alternating between them, and then swaps the
+    reference to it. Each buffer has a sequence number that is odd while it is being written; readers
+    copy the current buffer out and only retry if the writer came back to that buffer meanwhile.
+
+    A second consumer-producer that lists the bus as an output raises ValueError when it is created.
+    """
+
+    def __init__(self,
+                 initial_message=0,
+                 name="Unnamed Single Writer Bus",
+                 seqlock=False):  # copy array messages through a seqlock instead of swapping references
+
+        self.seqlock = seqlock
+        self.buffers = [None, None]
+        self.seqs = [0, 0]
+        self.current = 0  # index of the buffer holding the current message
+        self.writer = None
+
+        super().__init__(initial_message, name)
+
+        if seqlock and isinstance(initial_message, np.ndarray):
+            self.buffers[0] = self.message = initial_message.copy()
+
+    def registerWriter(self, name):
+
+        if self.writer is not None:
+            raise ValueError("{:s}: already written by {:s}, can not add writer {:s}".format(self.name, self.writer, name))
+        self.writer = name
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
+    def get_message(self, _name='Unspecified function'):
+
+        if not self.seqlock:
+            return self.message
+
+        # Messages that are not arrays are swapped in like on the plain path
+        if not isinstance(self.message, np.ndarray):
+            return self.message
+
+        while True:
+            index = self.current
+            seq = self.seqs[index]
+
+            # Copy the buffer out, and try again if the writer started on it meanwhile
+            if seq % 2 == 0:
+                copy = self.buffers[index].copy()
+                if self.seqs[index] == seq:
+                    return copy
+            time.sleep(0)
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        if self.seqlock and isinstance(message, np.ndarray):
+            # Write into the buffer that does not hold the current message
+            index = 1 - self.current
+            buffer = self.buffers[index]
+
+            # Mark the buffer as being written while the array is copied into it
+            self.seqs[index] += 1
+            if isinstance(buffer, np.ndarray) and buffer.shape == message.shape and buffer.dtype == message.dtype:
+                np.copyto(buffer, message)
+            else:
+                buffer = self.buffers[index] = message.copy()
+            self.seqs[index] += 1
+
+            # Publish the buffer
+            self.current = index
+            self.message = buffer
+        else:
+            self.message = message
+
+        self.version += 1
+        self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+
+class ArrayBus(Bus):
+    """
+    Bus for NumPy arrays of a fixed shape and dtype (e.g. 480x640x3 uint8 camera frames) that passes
+    them without allocating or copying anything per message.
+
+    The bus owns a set of preallocated buffers (three by default, triple buffering). The writer fills the
+    buffer returned by acquire() in place and writes it back with set_message (or calls publish), which
+    swaps it in as the current message. Readers get read-only views of the current buffer. A view stays
+    valid until the same reader (the same name in the same thread) calls get_message again, or calls
+    release: the writer never
+    acquires a buffer that is current or still held by a reader. If every buffer is taken (more readers
+    holding old frames than spare buffers), one more buffer is added, so after the first few frames no
+    more memory is allocated.
+
+    set_message also accepts any other array of the right shape and dtype, which costs one copy.
+    """
+
+    def __init__(self,
+                 shape,  # shape of the arrays, e.g. (480, 640, 3)
+                 dtype=np.uint8,
+                 name="Unnamed Array Bus",
+                 buffers=3,  # number of preallocated buffers, at least 2
+                 initial_message=None):  # array to start with, zeros if None
+
+        if buffers < 2:
+            raise ValueError("{:s}: an array bus needs at least 2 buffers, got {}".format(name, buffers))
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.buffers = []
+        self.views = []
+        for i in range(buffers):
+            self.addBuffer()
+
+        self.front = 0  # buffer holding the current message
+        self.back = None  # buffer acquired by the writer
+        self.held = {}  # (reader name, thread) -> buffer it holds a view of
+        self.added_buffers = 0  # buffers added beyond the preallocated ones
+        self.writer = None  # name of the consumer-producer writing the bus
+
+        # Only guards the buffer bookkeeping, never held while copying
+        self.buffer_lock = threading.Lock()
+
+        if initial_message is not None:
+            np.copyto(self.buffers[0], initial_message)
+
+        super().__init__(self.views[0], name)
+
+    # Allocate a buffer, with a read-only view of it for the readers
+    def addBuffer(self):
+
+        buffer = np.zeros(self.shape, self.dtype)
+        view = buffer.view()
+        view.flags.writeable = False
+        self.buffers.append(buffer)
+        self.views.append(view)
+
+        return len(self.buffers) - 1
+
+    def registerWriter(self, name):
+
+        # The acquired buffer belongs to a single writer
+        if self.writer is not None:
+            raise ValueError("{:s}: already written by {:s}, can not add writer {:s}".format(self.name, self.writer, name))
+        self.writer = name
+
+    def acquire(self, _name='Unspecified function'):
+        """
+        Get the buffer for the next message, to be filled in place and then passed to set_message.
+        Calling acquire again before the message is written returns the same buffer.
+        """
+
+        with self.buffer_lock:
+            if self.back is None:
+                taken = set(self.held.values())
+                taken.add(self.front)
+                free = [i for i in range(len(self.buffers)) if i not in taken]
+                if free:
+                    self.back = free[0]
+                else:
+                    self.back = self.addBuffer()
+                    self.added_buffers += 1
+
+            return self.buffers[self.back]
+
+    def publish(self, _name='Unspecified function'):
+        """
+        Make the acquired buffer the current message
+        """
+
+        with self.buffer_lock:
+            if self.back is None:
+                raise RuntimeError("{:s}: publish called without acquiring a buffer".format(self.name))
+            self.front = self.back
+            self.back = None
+            self.message = self.views[self.front]
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
+    def get_message(self, _name='Unspecified function'):
+
+        with self.buffer_lock:
+            # The reader gives up the view it got last time, and holds the current buffer instead.
+            # Readers are told apart by thread as well, as several may share a name (or use the default one)
+            self.held[(_name, threading.get_ident())] = self.front
+            return self.views[self.front]
+
+    def release(self, _name='Unspecified function'):
+        """
+        Tell the bus that a reader no longer uses the view it got
+        """
+
+        with self.buffer_lock:
+            self.held.pop((_name, threading.get_ident()), None)
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        # The acquired buffer is swapped in without a copy
+        if self.back is not None and message is self.buffers[self.back]:
+            self.publish(_name)
+            return
+
+        # Any other array is copied into a buffer
+        message = np.asarray(message)
+        if message.shape != self.shape or message.dtype != self.dtype:
+            raise ValueError("{:s}: expected an array of shape {} and dtype {}, got {} {}".format(
+                self.name, self.shape, self.dtype, message.shape, message.dtype))
+        np.copyto(self.acquire(_name), message)
+        self.publish(_name)
+
+
+class RingBus(Bus):
+    """
+    Bus that keeps the last `capacity` messages in a preallocated ring buffer. Every message gets a
+    sequence number (its bus version), get_message returns the latest message like a plain Bus, and
+    get_messages(since=seq) returns all of the messages from sequence number seq on that are still
+    in the buffer, so that a consumer can work through a backlog in one batch.
+    """
+
+    def __init__(self,
+                 initial_message=None,  # first message in the buffer, None for an empty buffer
+                 name="Unnamed Ring Bus",
+                 capacity=64):  # number of messages kept
+
+        super().__init__(initial_message, name)
+
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+
+        if initial_message is not None:
+            self.buffer[0] = initial_message
+            self.version = 1
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        with self.lock.gen_wlock():
+            self.buffer[self.version % self.capacity] = message
+            self.message = message
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    def get_messages(self, since=0, _name='Unspecified function'):
+        """
+        Get the messages with sequence numbers from `since` up to the latest one, oldest first.
+        Messages that were already overwritten are left out (the first returned message then has the
+        sequence number next_seq - len(messages)).
+
+        Returns the list of messages, and the sequence number to pass as `since` on the next call
+        """
+
+        with self.lock.gen_rlock():
+            next_seq = self.version
+            start = max(since, next_seq - self.capacity, 0)
+            messages = [self.buffer[seq % self.capacity] for seq in range(start, next_seq)]
+
+        return messages, next_seq
+
+
+class ProcessBus(Bus):
+    """
+    Bus whose message lives in shared memory, so that consumer-producers running in different
+    processes (see runConcurrently) can exchange messages through it.
+
+    Messages are pickled with protocol 5, which hands the data of NumPy arrays (and other buffer
+    objects) over separately: their bytes are copied straight into the shared memory block on a write
+    and straight out of it on a read, without being serialized. A write fails with ValueError if the
+    message does not fit into the block.
+
+    Subscribed listeners (and so triggered consumer-producers and wait) only hear about writes made
+    in their own process. Call close() once the bus is no longer used to free the shared memory.
+    """
+
+    # version, pickle length, buffer count and the lengths of up to 16 out-of-band buffers
+    HEADER = struct.Struct("<QQI4x16Q")
+    MAX_BUFFERS = 16
+    ALIGNMENT = 64  # buffers start on cache line boundaries
+
+    def __init__(self,
+                 initial_message=0,
+                 name="Unnamed Process Bus",
+                 size=1 << 20):  # bytes of shared memory for a message
+
+        # The shared memory and its lock are set up first, because the Bus init already sets the version
+        self.shm = shared_memory.SharedMemory(create=True, size=self.dataOffset() + size)
+        self.process_lock = multiprocessing.get_context("fork").Lock()
+        self.owner = True
+
+        super().__init__(initial_message, name)
+
+        self.set_message(initial_message, name)
+
+    @classmethod
+    def dataOffset(cls):
+        return -(-cls.HEADER.size // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    # The version is kept in the shared memory header, so that every process sees the writes of the others
+    @property
+    def version(self):
+        return struct.unpack_from("<Q", self.shm.buf, 0)[0]
+
+    @version.setter
+    def version(self, value):
+        struct.pack_into("<Q", self.shm.buf, 0, value)
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
+    def get_message(self, _name='Unspecified function'):
+
+        buf = self.shm.buf
+        with self.process_lock:
+            header = self.HEADER.unpack_from(buf, 0)
+            pickle_length, buffer_count = header[1], header[2]
+
+            # Copy the pickle and the array data out of the shared memory
+            offset = self.dataOffset()
+            data = bytes(buf[offset:offset + pickle_length])
+            offset += pickle_length
+            buffers = []
+            for length in header[3:3 + buffer_count]:
+                offset = -(-offset // self.ALIGNMENT) * self.ALIGNMENT
+                buffers.append(bytearray(buf[offset:offset + length]))
+                offset += length
+
+        return pickle.loads(data, buffers=buffers)
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        # Pickle the message, keeping the array data out of the pickle
+        buffers = []
+        data = pickle.dumps(message, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+        if len(buffers) > self.MAX_BUFFERS:
+            data = pickle.dumps(message, protocol=5)
+            buffers = []
+
+        # Check that everything fits before touching the shared memory
+        end = self.dataOffset() + len(data)
+        for b in buffers:
+            end = -(-end // self.ALIGNMENT) * self.ALIGNMENT + b.nbytes
+        if end > self.shm.size:
+            raise ValueError("{:s}: message of {:d} bytes does not fit into {:d} bytes of shared memory"
+                             .format(self.name, end - self.dataOffset(), self.shm.size - self.dataOffset()))
+
+        buf = self.shm.buf
+        with self.process_lock:
+            offset = self.dataOffset()
+            buf[offset:offset + len(data)] = data
+            offset += len(data)
+            for b in buffers:
+                offset = -(-offset // self.ALIGNMENT) * self.ALIGNMENT
+                buf[offset:offset + b.nbytes] = b
+                offset += b.nbytes
+
+            lengths = [b.nbytes for b in buffers] + [0] * (self.MAX_BUFFERS - len(buffers))
+            self.HEADER.pack_into(buf, 0, self.version + 1, len(data), len(buffers), *lengths)
+
+        # The write time is only known in this process
+        self.timestamp = time.monotonic()
+
+        # Wake up anything in this process waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    def close(self):
+        """
+        Release the shared memory. The process that created the bus also removes it from the system.
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def offload(executor="thread"):
+    """
+    Decorator that marks a consumer-producer function to be run in an executor by rossros_asyncio:
+    "thread" for functions that block (e.g. on a serial port), "process" for CPU-heavy functions (which
+    then have to be defined at the top level of a module), or a concurrent.futures executor object.
+    The threaded rossros ignores the mark, as each of its consumer-producers already has its own thread.
+    """
+
+    def mark(function):
+        function.rossros_executor = executor
+        return function
+
+    return mark
+
+
+def callWithoutInput(function, _input_value):
+    """
+    Function that calls a producer function, which takes no input
+    """
+    return function()
 
 
 def ensureTuple(value):
@@ -64,6 +852,27 @@ class ConsumerProducer:
     the input buses, stores the resulting data into the output buses,
     and watches a set of termination buses for a "True" or non-negative signal, at which
     point the service shuts down
+
+    By default the service sleeps for a fixed delay after each pass through its loop, so that the
+    loop period is the delay plus the time the function takes. If a rate (in Hz) is given instead, each
+    pass starts at a fixed deadline on the monotonic clock, and the delay is ignored. A pass that takes
+    longer than one period is counted as an overrun, and the overrun_policy decides what happens next:
+    "skip" drops the deadlines that were missed and waits for the next one, "catchup" runs the missed
+    passes back to back until the loop is on schedule again.
+
+    If a trigger is given instead, the service does not sleep between passes, but waits until its input
+    buses have been written to: with trigger="any" a pass runs as soon as one input bus has a new
+    message, with trigger="all" once every input bus has a new message.
+
+    Sleeps and trigger waits end as soon as a termination bus triggers or stop is called, so a service
+    with a long delay does not hold up the shutdown of the graph.
+
+    The failure_policy decides what happens when the function raises an exception, and, if a watchdog
+    time (in seconds) is given, when the service has not completed a pass for that long (because its
+    function is stuck; a triggered service waiting for new inputs is not stalled): "fail" stops the whole graph and
+    makes runConcurrently raise, "restart" logs the problem and starts the loop again, and "safe_value"
+    writes safe_value to the output buses (dealt like a function result), where it stays until the
+    service writes a new result.
     """
 
     @log_on_start(DEBUG, "{name:s}: Starting to create consumer-producer")
@@ -75,7 +884,13 @@ class ConsumerProducer:
                  output_buses,
                  delay=0,
                  termination_buses=Bus(False, "Default consumer_producer termination bus"),
-                 name="Unnamed consumer_producer"):
+                 name="Unnamed consumer_producer",
+                 rate=None,  # loop frequency in Hz, replaces the delay if given
+                 overrun_policy="skip",  # "skip" or "catchup", what to do after a pass took too long
+                 trigger=None,  # "any" or "all", run when the input buses get new messages instead of polling
+                 watchdog=None,  # seconds without a completed pass after which the failure policy applies
+                 failure_policy="fail",  # "fail", "restart" or "safe_value", what to do on errors and watchdog trips
+                 safe_value=None):  # value written to the output buses by the "safe_value" policy
 
         self.consumer_producer_function = consumer_producer_function
         self.input_buses = ensureTuple(input_buses)
@@ -84,29 +899,385 @@ class ConsumerProducer:
         self.termination_buses = ensureTuple(termination_buses)
         self.name = name
 
+        # Let the output buses check their number of writers
+        for bus in self.output_buses:
+            bus.registerWriter(name)
+
+        # Check the rate mode settings
+        if rate is not None and rate <= 0:
+            raise ValueError("{:s}: rate must be positive, got {}".format(name, rate))
+        if overrun_policy not in ("skip", "catchup"):
+            raise ValueError("{:s}: unknown overrun policy {}".format(name, overrun_policy))
+        if trigger not in (None, "any", "all"):
+            raise ValueError("{:s}: unknown trigger {}".format(name, trigger))
+        if trigger is not None and rate is not None:
+            raise ValueError("{:s}: a triggered service can not also have a rate".format(name))
+        self.rate = rate
+        self.overrun_policy = overrun_policy
+        self.trigger = trigger
+
+        # Check the failure handling settings
+        if watchdog is not None and watchdog <= 0:
+            raise ValueError("{:s}: watchdog time must be positive, got {}".format(name, watchdog))
+        if failure_policy not in ("fail", "restart", "safe_value"):
+            raise ValueError("{:s}: unknown failure policy {}".format(name, failure_policy))
+        if failure_policy == "safe_value" and safe_value is None:
+            raise ValueError("{:s}: the safe_value policy needs a safe value".format(name))
+        self.watchdog = watchdog
+        self.failure_policy = failure_policy
+        self.safe_value = safe_value
+
+        # Time every pass if profiling is on, otherwise step stays the plain version
+        self.profile = None
+        self.input_timestamps = []  # write times of the input messages read by the current pass, when profiling
+        if moduleSetting(self, 'PROFILE', PROFILE):
+            self.profile = NodeProfile(name)
+            profiles.append(self.profile)
+            self.step = self.profiledStep
+
+        # Triggered mode: remember the input versions used by the last pass, and get woken up
+        # by writes to the input and termination buses
+        self.seen_versions = [-1] * len(self.input_buses)
+        self.trigger_condition = threading.Condition()
+        if trigger is not None:
+            for bus in self.input_buses + self.termination_buses:
+                bus.subscribe(self.notifyTrigger)
+
+        # Scheduling state and statistics for rate mode
+        self.deadline = None  # monotonic time at which the current pass should have started
+        self.iterations = 0
+        self.overruns = 0  # passes that took longer than one period
+        self.skipped_deadlines = 0  # deadlines dropped by the "skip" policy
+        self.total_jitter = 0.0  # summed lateness of the pass starts
+        self.max_jitter = 0.0
+
+        # Shutdown and watchdog state
+        self.stop_event = threading.Event()  # set to end the loop, wakes up its sleeps
+        self.runner = None  # thread running the loop, a loop in any other thread has been replaced
+        self.last_pass = None  # monotonic time the loop started or last completed a pass
+        self.tripped = False  # the watchdog has tripped since the last completed pass
+        self.waiting = False  # waiting for a trigger, which the watchdog does not count as stalled
+        self.watchdog_trips = 0
+        self.failures = 0  # exceptions raised by the function
+        self.restarts = 0
+
+        # Skip the logging decorators in the service loop if DEBUG logging is off
+        resolveLogging(self, ('collectbusesToValues', 'dealValuesTobuses', 'checkTerminationbuses'))
+
     @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
     @log_on_error(DEBUG, "{self.name:s}: Encountered an error while executing consumer-producer")
     @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
     def __call__(self):
 
+        # This thread now runs the loop, any earlier loop of this service stops writing
+        self.runner = threading.get_ident()
+        self.last_pass = time.monotonic()
+        self.tripped = False
+
+        # Wake up an earlier loop waiting for a trigger, so that it sees it has been replaced
+        self.notifyTrigger()
+
+        # Wake up as soon as a termination bus triggers
+        for bus in self.termination_buses:
+            bus.subscribe(self.checkStop)
+        for bus in self.output_buses:
+            bus.interruptWriters(False)
+
+        try:
+            while not self.stopped():
+
+                # Check if the loop should terminate
+                # termination_value = self.termination_buses[0].get_message(self.name)
+                if self.checkTerminationbuses():
+                    break
+
+                # In triggered mode, wait for new input messages (stopping if a termination bus triggers meanwhile)
+                if self.trigger is not None and not self.waitForTrigger():
+                    break
+
+                # Note the start of the pass for the rate statistics
+                self.startIteration()
+
+                # Read the inputs, run the function and write the outputs
+                try:
+                    self.step()
+                except Exception as error:
+                    if not self.handleFailure(error):
+                        raise
+
+                # Stop if the watchdog restarted the loop in another thread meanwhile
+                if self.abandoned():
+                    break
+                self.passCompleted()
+
+                # Pause for set amount of time, or in rate mode until the next deadline
+                self.pause(self.sleepTime())
+        finally:
+            for bus in self.termination_buses:
+                bus.unsubscribe(self.checkStop)
+
+            # Let runConcurrently know this service is done, unless a newer loop has taken over
+            if not self.abandoned():
+                self.stop_event.set()
+
+    # One pass through the loop: read the input buses, run the function, and write the output buses
+    def step(self):
+
+        # A loop replaced by the watchdog must not act on the inputs again
+        if self.abandoned():
+            return
+
+        # Collect all of the values from the input buses into a list
+        input_values = self.collectbusesToValues(self.input_buses)
+
+        # Get the output value or tuple of values corresponding to the inputs
+        output_values = self.consumer_producer_function(*input_values)
+
+        # A loop replaced by the watchdog, or still running after the graph was stopped, must not write
+        # its late results
+        if self.abandoned() or self.stopped():
+            return
+
+        # Deal the values into the output buses
+        self.dealValuesTobuses(output_values, self.output_buses)
+
+    # The same pass as step, timing each part for the profile
+    def profiledStep(self):
+
+        if self.abandoned():
+            return
+
+        t_start = time.monotonic()
+        input_values = self.collectbusesToValues(self.input_buses)
+        t_read = time.monotonic()
+
+        output_values = self.consumer_producer_function(*input_values)
+        t_function = time.monotonic()
+
+        if self.abandoned() or self.stopped():
+            return
+
+        self.dealValuesTobuses(output_values, self.output_buses)
+        t_end = time.monotonic()
+
+        self.recordProfile(t_start, t_read, t_function, t_end)
+
+    # Add the timing of one pass to the profile
+    def recordProfile(self, t_start, t_read, t_function, t_end):
+
+        # Age of the oldest input message at the time it was read (the write times are noted when the
+        # inputs are read, as the buses may have been written again since)
+        timestamps = [timestamp for timestamp in self.input_timestamps if timestamp is not None]
+        staleness = t_read - min(timestamps) if timestamps else None
+
+        self.profile.record(t_start, t_function - t_read, (t_read - t_start) + (t_end - t_function), staleness)
+
+    def stop(self):
+        """
+        End the loop after the current pass, waking it up if it is sleeping or waiting for a trigger
+        """
+
+        self.stop_event.set()
+        self.notifyTrigger()
+
+        # Let a write blocked on a full queue give up
+        for bus in self.output_buses:
+            bus.interruptWriters()
+
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    # Called by the termination buses after each write
+    def checkStop(self):
+        if self.checkTerminationbuses():
+            self.stop()
+
+    # Sleep between passes, ending early if the service is stopped
+    def pause(self, seconds):
+
+        if seconds > 0:
+            self.stop_event.wait(seconds)
+        else:
+            # Still give the other threads a turn
+            time.sleep(0)
+
+    # Check whether the watchdog has started the loop again in another thread
+    def abandoned(self):
+        return self.runner is not None and self.runner != threading.get_ident()
+
+    # Note a completed pass for the watchdog
+    def passCompleted(self):
+
+        self.last_pass = time.monotonic()
+        if self.tripped:
+            self.tripped = False
+            logger.warning("{:s}: recovered".format(self.name))
+
+    # Apply the failure policy to an exception raised in a pass. Returns True if the loop should go on.
+    def handleFailure(self, error):
+
+        self.failures += 1
+
+        if self.failure_policy == "fail":
+            return False
+
+        logger.exception("{:s}: pass failed: {}".format(self.name, error))
+
+        if self.failure_policy == "safe_value":
+            self.writeSafeValue()
+        else:
+            self.restarts += 1
+
+        # The rate schedule starts over after the failed pass
+        self.deadline = None
+        return True
+
+    # Write the safe value to the output buses
+    def writeSafeValue(self):
+        if self.stopped():
+            return
+        self.dealValuesTobuses(self.safe_value, self.output_buses)
+
+    def checkWatchdog(self, now):
+        """
+        Called regularly by runConcurrently. If the service has gone longer than its watchdog time
+        without completing a pass, applies the safe_value policy, and returns the failure policy for
+        runConcurrently to carry out; otherwise returns None.
+        """
+
+        if self.watchdog is None or self.last_pass is None or self.tripped or self.waiting or self.stopped():
+            return None
+
+        if now - self.last_pass <= self.watchdog:
+            return None
+
+        self.tripped = True
+        self.watchdog_trips += 1
+        logger.warning("{:s}: no pass completed for {:.3f} s".format(self.name, now - self.last_pass))
+
+        if self.failure_policy == "safe_value":
+            self.writeSafeValue()
+
+        return self.failure_policy
+
+    # Clock for the rate mode deadlines
+    def clock(self):
+        return time.monotonic()
+
+    # In rate mode, record how late the current pass starts compared to its deadline
+    def startIteration(self):
+
+        if self.rate is None:
+            return
+
+        now = self.clock()
+
+        # The first pass defines the schedule
+        if self.deadline is None:
+            self.deadline = now
+        else:
+            jitter = now - self.deadline
+            self.total_jitter += jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+
+        self.iterations += 1
+
+    # Work out how long to sleep before the next pass: the fixed delay, in rate mode
+    # the time left until the next deadline, and in triggered mode no time at all
+    def sleepTime(self):
+
+        if self.trigger is not None:
+            return 0
+
+        if self.rate is None:
+            return self.delay
+
+        period = 1.0 / self.rate
+
+        # After a failed pass the schedule starts over from now
+        if self.deadline is None:
+            self.deadline = self.clock()
+
+        self.deadline += period
+        now = self.clock()
+
+        # Handle a pass that ran past the next deadline
+        if now > self.deadline:
+            self.overruns += 1
+
+            # Catch up: start the next pass at once, its deadline stays in the past
+            if self.overrun_policy == "catchup":
+                return 0
+
+            # Skip: move on to the first deadline that is still ahead
+            missed = math.ceil((now - self.deadline) / period)
+            self.deadline += missed * period
+            self.skipped_deadlines += missed
+
+        return self.deadline - now
+
+    # Check whether the input buses have messages that the last pass did not see
+    def inputsUpdated(self):
+
+        newer = [bus.hasNewMessage(seen) for bus, seen in zip(self.input_buses, self.seen_versions)]
+
+        if self.trigger == "all":
+            return all(newer)
+        else:
+            return any(newer)
+
+    # Called by the input and termination buses after each write
+    def notifyTrigger(self):
+        with self.trigger_condition:
+            self.trigger_condition.notify_all()
+
+    # Wait until the inputs are updated. Returns False if a termination bus triggered instead.
+    def waitForTrigger(self):
+
+        self.waiting = True
+        try:
+            return self.waitForInputs()
+        finally:
+            # The watchdog times the pass from when the inputs arrived
+            if not self.abandoned():
+                self.waiting = False
+                self.last_pass = time.monotonic()
+
+    def waitForInputs(self):
+
         while True:
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
-            if self.checkTerminationbuses():
-                break
+            # Sleep until an input or termination bus is written to
+            with self.trigger_condition:
+                termination_versions = [bus.version for bus in self.termination_buses]
+                self.trigger_condition.wait_for(
+                    lambda: self.inputsUpdated() or self.stopped() or self.abandoned()
+                    or [bus.version for bus in self.termination_buses] != termination_versions)
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
+            # Also stop if the watchdog started the loop again in another thread
+            if self.stopped() or self.abandoned():
+                return False
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
+            # Record the versions the coming pass will read
+            if self.inputsUpdated():
+                self.seen_versions = [bus.version for bus in self.input_buses]
+                return True
+
+            if self.checkTerminationbuses():
+                return False
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+    def getScheduleStats(self):
+        """
+        Timing statistics of rate mode: number of passes, overruns, skipped deadlines, and the mean
+        and largest lateness (jitter) of the pass starts in seconds
+        """
 
-            # Pause for set amount of time
-            time.sleep(self.delay)
+        return {"rate": self.rate,
+                "iterations": self.iterations,
+                "overruns": self.overruns,
+                "skipped_deadlines": self.skipped_deadlines,
+                "mean_jitter": self.total_jitter / max(self.iterations - 1, 1),
+                "max_jitter": self.max_jitter}
 
     # Take in a bus or a tuple of buses, and store their
     # messages into a list
@@ -125,6 +1296,10 @@ class ConsumerProducer:
         for p in buses:
             values.append(p.get_message(self.name))
 
+        # When profiling, note the write times of the input messages just read, for their staleness
+        if self.profile is not None and buses is self.input_buses:
+            self.input_timestamps = [getattr(p, "timestamp", None) for p in buses]
+
         return values
 
     # Take in  a tuple of values and a tuple of buses, and deal the values
@@ -185,15 +1360,22 @@ class Producer(ConsumerProducer):
                  output_buses,
                  delay=0,
                  termination_buses=Bus(False, "Default producer termination bus"),
-                 name="Unnamed producer"):
+                 name="Unnamed producer",
+                 rate=None,
+                 overrun_policy="skip",
+                 watchdog=None,
+                 failure_policy="fail",
+                 safe_value=None):
 
         # Producers don't use an input bus
         input_buses = Bus(0, "Default producer input bus")
 
         # Match naming convention for this class with its parent class
-        # def syntax is necessary because a producer function will not accept
-        # input values
-        def consumer_producer_function(_input_value): return producer_function()
+        # The wrapper drops the input value, because a producer function will not accept
+        # input values (a partial of a top-level function, so that it can be sent to another process)
+        consumer_producer_function = functools.partial(callWithoutInput, producer_function)
+        if hasattr(producer_function, "rossros_executor"):
+            consumer_producer_function.rossros_executor = producer_function.rossros_executor
 
         # Call the parent class init function
         super().__init__(
@@ -202,7 +1384,13 @@ class Producer(ConsumerProducer):
             output_buses,
             delay,
             termination_buses,
-            name)
+            name,
+            rate,
+            overrun_policy,
+            None,
+            watchdog,
+            failure_policy,
+            safe_value)
 
 
 class Consumer(ConsumerProducer):
@@ -219,7 +1407,12 @@ class Consumer(ConsumerProducer):
                  input_buses,
                  delay=0,
                  termination_buses=Bus(False, "Default consumer termination bus"),
-                 name="Unnamed consumer"):
+                 name="Unnamed consumer",
+                 rate=None,
+                 overrun_policy="skip",
+                 trigger=None,
+                 watchdog=None,
+                 failure_policy="fail"):
 
         # Match naming convention for this class with its parent class
         consumer_producer_function = consumer_function
@@ -234,7 +1427,12 @@ class Consumer(ConsumerProducer):
             output_buses,
             delay,
             termination_buses,
-            name)
+            name,
+            rate,
+            overrun_policy,
+            trigger,
+            watchdog,
+            failure_policy)
 
 
 class Timer(Producer):
@@ -253,14 +1451,21 @@ class Timer(Producer):
                  duration=5,  # how many seconds the timer should run for (0 is forever)
                  delay=0,  # how many seconds to sleep for between checking time
                  termination_buses=Bus(False, "Default timer termination bus"),
-                 name="Unnamed termination timer"):
+                 name="Unnamed termination timer",
+                 rate=None,  # how often to check the time in Hz, replaces the delay if given
+                 overrun_policy="skip"):
+
+        # Resolve the logging of the timer function before handing it to the parent class
+        resolveLogging(self, ('timer',))
 
         super().__init__(
             self.timer,  # Timer class defines its own producer function
             output_buses,
             delay,
             termination_buses,
-            name)
+            name,
+            rate,
+            overrun_policy)
 
         self.duration = duration
         self.t_start = time.time()
@@ -292,14 +1497,20 @@ class Printer(Consumer):
                  delay=0,  # how many seconds to sleep for between printing data
                  termination_buses=Bus(False, "Default printer termination bus"),  # buses to check for termination
                  name="Unnamed termination timer",  # name of this printer
-                 print_prefix="Unspecified printer: "):  # prefix for output
+                 print_prefix="Unspecified printer: ",  # prefix for output
+                 rate=None,  # printing frequency in Hz, replaces the delay if given
+                 overrun_policy="skip",
+                 trigger=None):  # "any" or "all", print whenever the buses get new messages
 
         super().__init__(
             self.print_bus,  # Printer class defines its own printing function
             printer_bus,
             delay,
             termination_buses,
-            name)
+            name,
+            rate,
+            overrun_policy,
+            trigger)
 
         self.print_prefix = print_prefix
 
@@ -322,24 +1533,235 @@ class Printer(Consumer):
         print(output_string)                               # Print the formatted output
 
 
+class ProfileReporter(Producer):
+    """
+    ProfileReporter is a producer that periodically prints the statistics of all profiled
+    consumer-producers (see formatStats)
+    """
+
+    @log_on_start(DEBUG, "{name:s}: Starting to create profile reporter")
+    @log_on_error(DEBUG, "{name:s}: Encountered an error while creating profile reporter")
+    @log_on_end(DEBUG, "{name:s}: Finished creating profile reporter")
+    def __init__(self,
+                 delay=1,  # how many seconds to sleep for between reports
+                 termination_buses=Bus(False, "Default profile reporter termination bus"),
+                 name="Profile reporter"):
+
+        super().__init__(
+            self.report,  # ProfileReporter class defines its own producer function
+            Bus(None, "Default profile reporter output bus"),
+            delay,
+            termination_buses,
+            name)
+
+    def report(self):
+        print(formatStats())
+
+
+def shareBuses(groups):
+    """
+    Function that replaces each Bus used by consumer-producers in more than one group with a
+    ProcessBus holding the same message. Returns a list of (original bus, process bus) pairs.
+    """
+
+    # Find the groups that use each bus
+    users = {}
+    for group_index, group in enumerate(groups):
+        for cp in group:
+            for bus in cp.input_buses + cp.output_buses + cp.termination_buses:
+                users.setdefault(id(bus), (bus, set()))[1].add(group_index)
+
+    # Make process buses for the buses that cross process boundaries
+    replacements = {}
+    for bus, group_indices in users.values():
+        if len(group_indices) < 2 or isinstance(bus, ProcessBus):
+            continue
+        if isinstance(bus, (QueueBus, RingBus)):
+            raise ValueError("{:s}: queue and ring buses can not be shared between processes".format(bus.name))
+        replacements[id(bus)] = ProcessBus(bus.get_message("runConcurrently"), bus.name)
+
+    # Point the consumer-producers at the process buses
+    for group in groups:
+        for cp in group:
+            if cp.trigger is not None and any(isinstance(bus, ProcessBus) or id(bus) in replacements
+                                              for bus in cp.input_buses + cp.termination_buses):
+                raise ValueError("{:s}: triggered consumer-producers can only use buses within their own process"
+                                 .format(cp.name))
+            cp.input_buses = tuple(replacements.get(id(bus), bus) for bus in cp.input_buses)
+            cp.output_buses = tuple(replacements.get(id(bus), bus) for bus in cp.output_buses)
+            cp.termination_buses = tuple(replacements.get(id(bus), bus) for bus in cp.termination_buses)
+
+    return [(users[bus_id][0], process_bus) for bus_id, process_bus in replacements.items()]
+
+
+def runGroup(group):
+    """
+    Function run in each child process of runConcurrently, running its group of consumer-producers as threads
+    """
+
+    # The child only uses the shared memory of the parent, it must not remove it
+    for cp in group:
+        for bus in cp.input_buses + cp.output_buses + cp.termination_buses:
+            if isinstance(bus, ProcessBus):
+                bus.owner = False
+
+    runConcurrently(group)
+
+
+def runInProcesses(groups):
+    """
+    Function that runs each group of consumer-producers in its own (forked) process
+    """
+
+    # shareBuses points the consumer-producers at process buses for this run only
+    original_buses = [(cp, cp.input_buses, cp.output_buses, cp.termination_buses) for group in groups for cp in group]
+    shared = shareBuses(groups)
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=runGroup, args=(group,), name=group[0].name) for group in groups]
+
+    try:
+        for p in processes:
+            p.start()
+
+        # Wait for the processes, stopping the others as soon as one fails
+        remaining = list(processes)
+        while remaining:
+            multiprocessing.connection.wait([p.sentinel for p in remaining])
+            for p in [p for p in remaining if not p.is_alive()]:
+                p.join()
+                remaining.remove(p)
+                if p.exitcode != 0:
+                    for other in remaining:
+                        other.terminate()
+    finally:
+        # Copy the final messages back, so that the buses created by the caller stay up to date
+        for bus, process_bus in shared:
+            bus.set_message(process_bus.get_message("runConcurrently"), "runConcurrently")
+            process_bus.close()
+
+        # Point the consumer-producers back at their own buses, so that they can be run again
+        for cp, input_buses, output_buses, termination_buses in original_buses:
+            cp.input_buses, cp.output_buses, cp.termination_buses = input_buses, output_buses, termination_buses
+
+    failed = [p.name for p in processes if p.exitcode != 0]
+    if failed:
+        raise RuntimeError("runConcurrently: processes failed: {:s}".format(", ".join(failed)))
+
+
+def watchNodes(producer_consumer_list, done, failures, restart):
+    """
+    Function run in a thread by runConcurrently, which checks the watchdogs of the consumer-producers
+    until done is set, and carries out the "fail" and "restart" policies
+    """
+
+    timeouts = [cp.watchdog for cp in producer_consumer_list if cp.watchdog is not None]
+    if not timeouts:
+        return
+
+    # Check several times per watchdog time, so that a trip is noticed soon after the time runs out
+    while not done.wait(min(timeouts) / 4):
+        now = time.monotonic()
+        for cp in producer_consumer_list:
+            action = cp.checkWatchdog(now)
+            if action == "fail":
+                failures.append(RuntimeError("{:s}: watchdog tripped".format(cp.name)))
+                for other in producer_consumer_list:
+                    other.stop()
+            elif action == "restart":
+                cp.restarts += 1
+                restart(cp)
+
+
 @log_on_start(DEBUG, "runConcurrently: Starting concurrent execution")
 @log_on_error(DEBUG, "runConcurrently: Encountered an error during concurrent execution")
 @log_on_end(DEBUG, "runConcurrently: Finished concurrent execution")
-def runConcurrently(producer_consumer_list):
+def runConcurrently(producer_consumer_list, processes=False, shutdown_timeout=None):
     """
-    runConcurrently is aFunction that uses a concurrent.futures ThreadPoolExecutor to concurrently
-    execute a set of ConsumerProducer functions
+    runConcurrently is a function that runs a set of ConsumerProducers concurrently, each in its own thread
+
+    Entries of the list can also be lists of consumer-producers. With processes=True each entry
+    runs in its own process (the consumer-producers of a list share one process, as threads), so that
+    CPU-bound consumer-producers do not compete for the GIL. Buses used in more than one process
+    are swapped for ProcessBuses for the run, and their final messages are copied back at the end.
+
+    The run ends when every consumer-producer has stopped. If one of them fails (its function raises with
+    the "fail" policy, or its watchdog trips), the others are stopped and the error is raised once they
+    have finished. Ctrl-C (or requestShutdown) stops all of them. Once all have been told to stop, a
+    consumer-producer whose function is stuck is waited for at most shutdown_timeout seconds (forever if
+    None); it is then left behind in its (daemon) thread and a warning is logged.
     """
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(producer_consumer_list)) as executor:
-
-        # Create a list to hold the executors created from the provided functions
-        executor_list = []
+    # Run each entry in its own process
+    if processes:
+        runInProcesses([list(entry) if isinstance(entry, (list, tuple)) else [entry]
+                        for entry in producer_consumer_list])
+        return
+
+    # In a single process, groups make no difference
+    producer_consumer_list = [cp for entry in producer_consumer_list
+                              for cp in (entry if isinstance(entry, (list, tuple)) else [entry])]
+
+    failures = []
+    threads = {}  # thread currently running the loop of each consumer-producer
+
+    # Run a consumer-producer, stopping the others if it fails
+    def run(cp):
+        try:
+            cp()
+        except Exception as error:
+            failures.append(error)
+            for other in producer_consumer_list:
+                other.stop()
+
+    # Start (or restart) the loop of a consumer-producer in a new thread
+    def start(cp):
+        thread = threading.Thread(target=run, args=(cp,), name=cp.name, daemon=True)
+        threads[cp] = thread
+        thread.start()
+
+    for cp in producer_consumer_list:
+        cp.stop_event.clear()
+    running_nodes.extend(producer_consumer_list)
+
+    done = threading.Event()
+    watchdog = threading.Thread(target=watchNodes, args=(producer_consumer_list, done, failures, start),
+                                name="runConcurrently watchdog", daemon=True)
+
+    interrupted = False
+    stop_time = None
+    try:
+        for cp in producer_consumer_list:
+            start(cp)
+        watchdog.start()
 
-        # Loop over the list of provided functions, turning each into an executor for the thread pool
+        # Wait for the loops to end, checking regularly for stuck ones once all have been told to stop
+        while True:
+            try:
+                alive = [cp for cp, thread in threads.items() if thread.is_alive()]
+                if not alive:
+                    break
+
+                if stop_time is None and all(cp.stopped() for cp in producer_consumer_list):
+                    stop_time = time.monotonic()
+                if (stop_time is not None and shutdown_timeout is not None
+                        and time.monotonic() - stop_time > shutdown_timeout):
+                    logger.warning("runConcurrently: left behind stuck consumer-producers: {:s}".format(
+                        ", ".join(cp.name for cp in alive)))
+                    break
+
+                threads[alive[0]].join(0.05)
+
+            except KeyboardInterrupt:
+                interrupted = True
+                for cp in producer_consumer_list:
+                    cp.stop()
+    finally:
+        done.set()
         for cp in producer_consumer_list:
-            executor_list.append(executor.submit(cp))
+            running_nodes.remove(cp)
 
-    # Loop over the executors that were created above, running their result methods
-    for e in executor_list:
-        e.result()
+    if interrupted:
+        raise KeyboardInterrupt
+    if failures:
+        raise failures[0]
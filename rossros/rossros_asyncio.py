@@ -17,9 +17,11 @@ import rossros_asyncio
 and expect your code to run as before (assuming that you haven't incorporated any extra dependencies on
 the threading architecture from concurrent.futures).
 
-While running RossROS AsyncIO, you can include calls to "await.sleep" within the consumer and producer functions
-(but note that any such calls will stack with the loop delay time, so that you should decrease the loop delay
-to keep the same overall execution frequency).
+While running RossROS AsyncIO, the consumer and producer functions can also be "async def" functions, which can
+include calls to "await asyncio.sleep" (but note that any such calls will stack with the loop delay time, so that
+you should decrease the loop delay to keep the same overall execution frequency, or use a rate instead).
+Functions that block (e.g. waiting on a serial port) can be marked with @offload("thread"), and CPU-heavy
+functions with @offload("process"), to run them outside of the event loop.
 
 --
 
@@ -36,6 +38,7 @@ Third, it replaces the runConcurrently function with a version that uses the asy
 
 from .rossros import *
 import asyncio
+import concurrent.futures
 
 
 """ First Change: For asyncio, locking is handled manually, so the Bus class does not the the RWLock code"""
@@ -50,6 +53,14 @@ class Bus:
         self.message = initial_message
         self.name = name
 
+        # Count the writes, note the time of the last one, and keep a list of functions to call after each write
+        self.version = 0
+        self.timestamp = None
+        self.listeners = []
+
+        # Skip the logging decorators on reads and writes if DEBUG logging is off
+        resolveLogging(self, ('get_message', 'set_message'))
+
     @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
     @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
     @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
@@ -62,6 +73,41 @@ class Bus:
     @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
     def set_message(self, message, _name):
         self.message = message
+        self.version += 1
+        self.timestamp = time.monotonic()
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    def hasNewMessage(self, version):
+        return self.version > version
+
+    def registerWriter(self, name):
+        pass
+
+    def interruptWriters(self, interrupt=True):
+        pass
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    async def wait(self, version):
+        """
+        Wait until the bus holds a message newer than the given version
+        """
+
+        event = asyncio.Event()
+        self.subscribe(event.set)
+        try:
+            while self.version <= version:
+                event.clear()
+                await event.wait()
+        finally:
+            self.unsubscribe(event.set)
 
 
 """"
@@ -71,170 +117,322 @@ and have an "await asyncio.sleep" call instead of time.sleep.
 The "from rossros import *" call at the beginning of the file brings all items in the rossros namespace into the
 rossros_asyncio namespace. Declaring classes in rossros_asyncio that inherit from their same-named classes in rossros
 then allows us to redefine the __call__ method to be asyncio-aware.
-"""
 
+The asyncio-aware loop is written once, in the AsyncLoop class, and each class gets it by listing AsyncLoop
+ahead of its rossros version as a parent class. The loop:
 
-class ConsumerProducer(ConsumerProducer):
+* awaits the result of the function if it is a coroutine, so "async def" functions can be used directly,
 
-    @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
-    @log_on_error(DEBUG, "{self.name:s}: Encountered an error while closing down consumer-producer")
-    @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
-    async def __call__(self):
+* runs functions marked with @offload("thread") or @offload("process") in an executor, so that a
+blocking function (e.g. a serial read) does not stop the other tasks while it runs,
 
-        while True:
+* measures rate mode deadlines on the event loop's clock, and waits for triggered inputs on an asyncio.Event
+that the buses set on every write, instead of on a threading.Condition,
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
-            if self.checkTerminationbuses():
-                break
+* sleeps on an asyncio.Event that stop sets, so that a stopped service wakes up at once.
+"""
+
+
+# Executors for offloaded functions, created when they are first needed
+executors = {}
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
+def getExecutor(kind):
+    """
+    Function that returns the executor for an @offload marker: "thread", "process", or an executor object
+    """
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+    if isinstance(kind, concurrent.futures.Executor):
+        return kind
 
-            # Pause for set amount of time
-            await asyncio.sleep(self.delay)
+    if kind not in executors:
+        if kind == "thread":
+            executors[kind] = concurrent.futures.ThreadPoolExecutor()
+        elif kind == "process":
+            executors[kind] = concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("fork"))
+        else:
+            raise ValueError("unknown executor {}".format(kind))
 
+    return executors[kind]
 
-class Producer(Producer):
+
+class AsyncLoop:
+    """
+    Mixin with the asyncio version of the consumer-producer loop
+    """
+
+    trigger_event = None
+    stop_async = None  # asyncio version of the stop event, for the sleeps
 
     @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
     @log_on_error(DEBUG, "{self.name:s}: Encountered an error while closing down consumer-producer")
     @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
     async def __call__(self):
 
-        while True:
+        self.event_loop = asyncio.get_running_loop()
+        self.stop_async = asyncio.Event()
+        if self.stopped():
+            self.stop_async.set()
+        self.last_pass = time.monotonic()
+        self.tripped = False
+
+        # Wake up as soon as a termination bus triggers
+        for bus in self.termination_buses:
+            bus.subscribe(self.checkStop)
+        for bus in self.output_buses:
+            bus.interruptWriters(False)
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
-            if self.checkTerminationbuses():
-                break
+        try:
+            while not self.stopped():
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
+                # Check if the loop should terminate
+                # termination_value = self.termination_buses[0].get_message(self.name)
+                if self.checkTerminationbuses():
+                    break
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
+                # In triggered mode, wait for new input messages (stopping if a termination bus triggers meanwhile)
+                if self.trigger is not None and not await self.waitForTrigger():
+                    break
+
+                # Note the start of the pass for the rate statistics
+                self.startIteration()
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+                # Read the inputs, run the function and write the outputs
+                try:
+                    await self.step()
+                except Exception as error:
+                    if not self.handleFailure(error):
+                        raise
+                self.passCompleted()
 
-            # Pause for set amount of time
-            await asyncio.sleep(self.delay)
+                # Pause for set amount of time, or in rate mode until the next deadline
+                await self.pause(self.sleepTime())
+        finally:
+            for bus in self.termination_buses:
+                bus.unsubscribe(self.checkStop)
 
+            # Let runConcurrently know this service is done
+            self.stop_event.set()
 
-class Consumer(Consumer):
+    # Wake up the sleeps as well, also when called from another thread
+    def stop(self):
 
-    @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
-    @log_on_error(DEBUG, "{self.name:s}: Encountered an error while closing down consumer-producer")
-    @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
-    async def __call__(self):
+        super().stop()
+        if self.stop_async is not None:
+            self.event_loop.call_soon_threadsafe(self.stop_async.set)
 
-        while True:
+    # Sleep between passes, ending early if the service is stopped
+    async def pause(self, seconds):
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
-            if self.checkTerminationbuses():
-                break
+        if seconds > 0 and not self.stopped():
+            try:
+                await asyncio.wait_for(self.stop_async.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(0)
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
+    # Deadlines are kept on the event loop's clock
+    def clock(self):
+        return asyncio.get_running_loop().time()
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
+    # Run the function: offloaded to an executor if it is marked for it, and awaited if it is a coroutine
+    async def callFunction(self, input_values):
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+        function = self.consumer_producer_function
+        kind = getattr(function, "rossros_executor", None)
 
-            # Pause for set amount of time
-            await asyncio.sleep(self.delay)
+        if kind is not None:
+            result = await asyncio.get_running_loop().run_in_executor(getExecutor(kind), function, *input_values)
+        else:
+            result = function(*input_values)
 
+        if inspect.isawaitable(result):
+            result = await result
 
-class Printer(Printer):
+        return result
 
-    @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
-    @log_on_error(DEBUG, "{self.name:s}: Encountered an error while closing down consumer-producer")
-    @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
-    async def __call__(self):
+    # One pass through the loop: read the input buses, run the function, and write the output buses
+    async def step(self):
 
-        while True:
+        input_values = self.collectbusesToValues(self.input_buses)
+        output_values = await self.callFunction(input_values)
+        if self.stopped():
+            return
+        self.dealValuesTobuses(output_values, self.output_buses)
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
-            if self.checkTerminationbuses():
-                break
+    # The same pass as step, timing each part for the profile
+    async def profiledStep(self):
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
+        t_start = time.monotonic()
+        input_values = self.collectbusesToValues(self.input_buses)
+        t_read = time.monotonic()
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
+        output_values = await self.callFunction(input_values)
+        t_function = time.monotonic()
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+        if self.stopped():
+            return
 
-            # Pause for set amount of time
-            await asyncio.sleep(self.delay)
+        self.dealValuesTobuses(output_values, self.output_buses)
+        t_end = time.monotonic()
 
+        self.recordProfile(t_start, t_read, t_function, t_end)
 
-class Timer(Timer):
+    # Called by the input and termination buses after each write
+    def notifyTrigger(self):
+        if self.trigger_event is not None:
+            self.trigger_event.set()
 
-    @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
-    @log_on_error(DEBUG, "{self.name:s}: Encountered an error while closing down consumer-producer")
-    @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
-    async def __call__(self):
+    # Wait until the inputs are updated. Returns False if a termination bus triggered instead.
+    async def waitForTrigger(self):
+
+        self.waiting = True
+        try:
+            return await self.waitForInputs()
+        finally:
+            # The watchdog times the pass from when the inputs arrived
+            self.waiting = False
+            self.last_pass = time.monotonic()
+
+    async def waitForInputs(self):
+
+        if self.trigger_event is None:
+            self.trigger_event = asyncio.Event()
 
         while True:
 
-            # Check if the loop should terminate
-            # termination_value = self.termination_buses[0].get_message(self.name)
+            # Sleep until an input or termination bus is written to
+            termination_versions = [bus.version for bus in self.termination_buses]
+            while not (self.inputsUpdated() or self.stopped()
+                       or [bus.version for bus in self.termination_buses] != termination_versions):
+                self.trigger_event.clear()
+                await self.trigger_event.wait()
+
+            if self.stopped():
+                return False
+
+            # Record the versions the coming pass will read
+            if self.inputsUpdated():
+                self.seen_versions = [bus.version for bus in self.input_buses]
+                return True
+
             if self.checkTerminationbuses():
-                break
+                return False
+
+
+class ConsumerProducer(AsyncLoop, ConsumerProducer):
+    pass
+
+
+class Producer(AsyncLoop, Producer):
+    pass
+
 
-            # Collect all of the values from the input buses into a list
-            input_values = self.collectbusesToValues(self.input_buses)
+class Consumer(AsyncLoop, Consumer):
+    pass
 
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
 
-            # Deal the values into the output buses
-            self.dealValuesTobuses(output_values, self.output_buses)
+class Printer(AsyncLoop, Printer):
+    pass
 
-            # Pause for set amount of time
-            await asyncio.sleep(self.delay)
+
+class Timer(AsyncLoop, Timer):
+    pass
+
+
+class ProfileReporter(AsyncLoop, ProfileReporter):
+    pass
 
 
 """
 Third change: Replace the runConcurrently function with a version that calls asyncio.run. This function requires
-a helper function (gather) to set up the execution calls
+a helper function (gather) to run the consumer-producers as tasks, and to check their watchdogs while they run
 """
 
 @log_on_start(DEBUG, "runConcurrently: Starting concurrent execution")
 @log_on_error(DEBUG, "runConcurrently: Encountered an error during concurrent execution")
 @log_on_end(DEBUG, "runConcurrently: Finished concurrent execution")
-async def gather(producer_consumer_list):
+async def gather(producer_consumer_list, shutdown_timeout=None):
     """
-    Function that uses asyncio.gather to concurrently
-    execute a set of ConsumerProducer functions
+    Function that runs a set of ConsumerProducers as asyncio tasks until they have all stopped
     """
 
-    # Make a new list of producer_consumers by evaluating the input list
-    # (this evaluation matches syntax with rossros.py)
-    producer_consumer_list2 = []
-    for pc in producer_consumer_list:
-        producer_consumer_list2.append(pc())
+    # Start a task for each consumer-producer
+    # (calling each one matches syntax with rossros.py)
+    tasks = {cp: asyncio.ensure_future(cp()) for cp in producer_consumer_list}
+    failures = []
+
+    # Check the watchdogs several times per watchdog time
+    timeouts = [cp.watchdog for cp in producer_consumer_list if cp.watchdog is not None]
+    interval = min([0.05] + [timeout / 4 for timeout in timeouts])
+
+    def stopAll():
+        for cp in producer_consumer_list:
+            cp.stop()
+
+    stop_time = None
+    while True:
+
+        pending = [task for task in tasks.values() if not task.done()]
+        if not pending:
+            break
+
+        if stop_time is None and all(cp.stopped() for cp in producer_consumer_list):
+            stop_time = time.monotonic()
+        if stop_time is not None and shutdown_timeout is not None and time.monotonic() - stop_time > shutdown_timeout:
+            logger.warning("runConcurrently: cancelled stuck consumer-producers: {:s}".format(
+                ", ".join(cp.name for cp, task in tasks.items() if not task.done())))
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+            break
+
+        done, _ = await asyncio.wait(pending, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+
+        # A consumer-producer that raised stops the others
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task.exception())
+                stopAll()
+
+        now = time.monotonic()
+        for cp in producer_consumer_list:
+            action = cp.checkWatchdog(now)
+            if action == "fail":
+                failures.append(RuntimeError("{:s}: watchdog tripped".format(cp.name)))
+                stopAll()
+            elif action == "restart":
+                # Cancel the stuck task (an offloaded call runs on, but its result is dropped) and start again
+                tasks[cp].cancel()
+                await asyncio.wait([tasks[cp]])
+                cp.restarts += 1
+                cp.stop_event.clear()
+                tasks[cp] = asyncio.ensure_future(cp())
+
+    if failures:
+        raise failures[0]
+
+
+def runConcurrently(producer_consumer_list, shutdown_timeout=None):
+    """
+    Function that uses asyncio.run to run a list of ConsumerProducers (see gather). As in rossros.py, a
+    failing consumer-producer stops the others, and shutdown_timeout limits how long stuck ones are waited for
+    once all have been told to stop.
+    """
 
-    await asyncio.gather(*producer_consumer_list2)
+    for cp in producer_consumer_list:
+        cp.stop_event.clear()
+    running_nodes.extend(producer_consumer_list)
 
+    try:
+        asyncio.run(gather(producer_consumer_list, shutdown_timeout))
+    finally:
+        for cp in producer_consumer_list:
+            running_nodes.remove(cp)
 
-def runConcurrently(producer_consumer_list):
-    """
-    Function that uses asyncio.run to tell asyncio.gather to run a list of
-    ConsumerProducers
-    """
-    asyncio.run(gather(producer_consumer_list))
+        # Shut down the executors used by offloaded functions (not waiting for stuck calls if there is a timeout)
+        for executor in executors.values():
+            executor.shutdown(wait=shutdown_timeout is None)
+        executors.clear()
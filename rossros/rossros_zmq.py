@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+"""
+This file adds a RossROS bus that is shared between machines over ZeroMQ
+
+--
+
+A ZmqBus behaves like a normal Bus within its own program, and can additionally publish every message
+written to it (publish="tcp://*:5560") and/or receive the messages published by a ZmqBus in another
+program, possibly on another machine (subscribe="tcp://192.168.1.10:5560"). A graph can then be split
+across several machines by giving the buses that connect the parts a publish address on the writing side
+and a subscribe address on the reading side, without changing the consumer-producers.
+
+Each bus chooses how received messages are kept:
+
+* mode="latest" keeps only the newest message, like a normal Bus. ZeroMQ is told to conflate (CONFLATE),
+so messages that arrive faster than they are picked up are dropped on the way.
+
+* mode="queue" keeps up to queue_size received messages in order, like a QueueBus. get_message takes the
+oldest one out of the queue, and returns empty_message when the queue is empty.
+
+--
+
+Messages travel as single ZeroMQ frames of the form
+
+topic + " " + json header + "\\n" + payload
+
+where the header carries a sequence number, the send time, and whatever the serializer needs to decode
+the payload. The serializer is chosen per bus: "pickle" (any Python object, the default), "json",
+"msgpack" (needs the msgpack package), or "numpy" (the raw bytes of a NumPy array, decoded without a
+copy). Any object with the same dumps/loads methods as the classes below can be passed instead.
+
+Every subscribing bus counts the messages it received, the messages it missed (gaps in the sequence
+numbers, which includes conflated messages in "latest" mode and messages dropped from a full queue),
+and the latency from sending to receiving. The latency is only meaningful if the clocks of the two
+machines are synchronized (e.g. with NTP).
+
+Received messages are handled by a background thread, which also wakes up triggered consumer-producers.
+This works with the threaded rossros; with rossros_asyncio, do not use triggered consumer-producers on a
+subscribing ZmqBus.
+"""
+
+from .rossros import *
+import json
+import pickle
+import logging
+import threading
+import collections
+import numpy as np
+import zmq
+
+
+class PickleSerializer:
+    """
+    Serializer for any picklable Python object
+    """
+
+    def dumps(self, message):
+        # Returns the header fields needed for decoding, and the payload bytes
+        return {}, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, header, payload):
+        return pickle.loads(payload)
+
+
+class JsonSerializer:
+    """
+    Serializer for JSON-compatible messages, readable by programs not written in Python
+    """
+
+    def dumps(self, message):
+        return {}, json.dumps(message).encode("utf-8")
+
+    def loads(self, header, payload):
+        return json.loads(bytes(payload))
+
+
+class MsgpackSerializer:
+    """
+    Serializer for msgpack-compatible messages, smaller and faster than JSON
+    """
+
+    def __init__(self):
+        # msgpack is only needed if this serializer is used
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, message):
+        return {}, self.msgpack.packb(message, use_bin_type=True)
+
+    def loads(self, header, payload):
+        return self.msgpack.unpackb(payload, raw=False)
+
+
+class NumpySerializer:
+    """
+    Serializer for NumPy arrays, which sends the raw array bytes with the dtype and shape in the
+    header. Received arrays are read-only views of the received frame.
+    """
+
+    def dumps(self, message):
+        array = np.ascontiguousarray(message)
+        return {"dtype": array.dtype.str, "shape": array.shape}, array.data
+
+    def loads(self, header, payload):
+        return np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+
+
+SERIALIZERS = {"pickle": PickleSerializer,
+               "json": JsonSerializer,
+               "msgpack": MsgpackSerializer,
+               "numpy": NumpySerializer}
+
+
+def getSerializer(serializer):
+    """
+    Function that turns a serializer name into a serializer, and passes serializer objects through
+    """
+
+    if isinstance(serializer, str):
+        if serializer not in SERIALIZERS:
+            raise ValueError("unknown serializer {}".format(serializer))
+        return SERIALIZERS[serializer]()
+
+    return serializer
+
+
+class ZmqBus(Bus):
+    """
+    Bus that publishes its messages over ZeroMQ and/or receives the messages published by other ZmqBuses
+    """
+
+    def __init__(self,
+                 initial_message=0,
+                 name="Unnamed ZMQ Bus",
+                 publish=None,  # address to publish the messages at, e.g. "tcp://*:5560"
+                 subscribe=None,  # address (or list of addresses) to receive messages from
+                 mode="latest",  # "latest" or "queue", how received messages are kept
+                 serializer="pickle",  # serializer name or object
+                 topic=None,  # ZeroMQ topic, defaults to the bus name
+                 queue_size=16,  # number of received messages kept in "queue" mode
+                 empty_message=None,  # returned by get_message when the queue is empty in "queue" mode
+                 context=None):  # ZeroMQ context, defaults to the shared one
+
+        if mode not in ("latest", "queue"):
+            raise ValueError("{:s}: unknown mode {}".format(name, mode))
+
+        super().__init__(initial_message, name)
+
+        self.mode = mode
+        self.serializer = getSerializer(serializer)
+        self.topic = (topic or name).replace(" ", "_").encode("utf-8")
+        self.queue_size = queue_size
+        self.empty_message = empty_message
+        self.queue = collections.deque()
+
+        # Counters for getStats
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.last_seq = None
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+
+        self.context = context or zmq.Context.instance()
+        self.closed = False
+
+        # Socket for publishing, ZeroMQ sockets must not be used by two threads at once
+        self.pub_socket = None
+        self.send_lock = threading.Lock()
+        if publish is not None:
+            self.pub_socket = self.context.socket(zmq.PUB)
+            self.setQueueOptions(self.pub_socket, zmq.SNDHWM)
+            self.pub_socket.bind(publish)
+
+        # Socket for receiving, read by a background thread
+        self.sub_socket = None
+        self.receiver = None
+        if subscribe is not None:
+            self.sub_socket = self.context.socket(zmq.SUB)
+            self.setQueueOptions(self.sub_socket, zmq.RCVHWM)
+            self.sub_socket.setsockopt(zmq.SUBSCRIBE, self.topic + b" ")
+            for address in ensureTuple(subscribe):
+                self.sub_socket.connect(address)
+
+            self.receiver = threading.Thread(target=self.receive, name=name + " receiver", daemon=True)
+            self.receiver.start()
+
+    # Keep only the latest message in ZeroMQ's own queues, or up to queue_size messages
+    def setQueueOptions(self, socket, hwm_option):
+
+        socket.setsockopt(zmq.LINGER, 0)
+        if self.mode == "latest":
+            socket.setsockopt(zmq.CONFLATE, 1)
+        else:
+            socket.setsockopt(hwm_option, self.queue_size)
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
+    def get_message(self, _name='Unspecified function'):
+
+        # Latest mode: the newest message, written locally or received
+        if self.mode == "latest":
+            with self.lock.gen_rlock():
+                message = self.message
+            return message
+
+        # Queue mode: the oldest received message
+        with self.lock.gen_wlock():
+            if not self.queue:
+                return self.empty_message
+            return self.queue.popleft()
+
+    @log_on_start(DEBUG, "{self.name:s}: Initiating write by {_name:s}")
+    @log_on_error(DEBUG, "{self.name:s}: Error on write by {_name:s}")
+    @log_on_end(DEBUG, "{self.name:s}: Finished write by {_name:s}")
+    def set_message(self, message, _name='Unspecified function'):
+
+        with self.lock.gen_wlock():
+            self.message = message
+            self.version += 1
+            self.timestamp = time.monotonic()
+
+        # Send the message to the subscribers
+        if self.pub_socket is not None:
+            header, payload = self.serializer.dumps(message)
+            with self.send_lock:
+                header.update({"seq": self.sent, "time": time.time()})
+                self.pub_socket.send(b"".join((self.topic, b" ", json.dumps(header).encode("utf-8"), b"\n",
+                                               payload)))
+                self.sent += 1
+
+        # Wake up anything waiting for a new message
+        for listener in self.listeners:
+            listener()
+
+    # Background thread that takes the received messages off the socket
+    def receive(self):
+
+        poller = zmq.Poller()
+        poller.register(self.sub_socket, zmq.POLLIN)
+
+        while not self.closed:
+
+            # Wake up regularly to notice when the bus is closed
+            if not poller.poll(100):
+                continue
+
+            try:
+                frame = self.sub_socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                continue
+            receive_time = time.time()
+
+            try:
+                # Split the frame into topic, header and payload, without copying the payload
+                header_end = frame.index(b"\n")
+                header = json.loads(frame[len(self.topic) + 1:header_end])
+                message = self.serializer.loads(header, memoryview(frame)[header_end + 1:])
+            except Exception as e:
+                logging.getLogger(__name__).warning("{:s}: could not decode a message: {}".format(self.name, e))
+                continue
+
+            self.countReceived(header, receive_time)
+
+            with self.lock.gen_wlock():
+                if self.mode == "latest":
+                    self.message = message
+                else:
+                    self.queue.append(message)
+                    if len(self.queue) > self.queue_size:
+                        self.queue.popleft()
+                        self.dropped += 1
+                self.version += 1
+                self.timestamp = time.monotonic()
+
+            for listener in self.listeners:
+                listener()
+
+    # Update the received, dropped and latency counters
+    def countReceived(self, header, receive_time):
+
+        seq = header["seq"]
+
+        # A gap in the sequence numbers means messages were lost or conflated, a step back means
+        # the publisher was restarted
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+
+        latency = receive_time - header["time"]
+        self.received += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+
+    def hasNewMessage(self, version):
+        if self.mode == "queue":
+            return len(self.queue) > 0
+        return self.version > version
+
+    def getStats(self):
+        """
+        Counters of the bus: messages sent, received and missed, and the mean, largest and last latency
+        of the received messages in seconds
+        """
+
+        return {"sent": self.sent,
+                "received": self.received,
+                "dropped": self.dropped,
+                "mean_latency": self.total_latency / self.received if self.received else None,
+                "max_latency": self.max_latency if self.received else None,
+                "last_latency": self.last_latency}
+
+    def close(self):
+        """
+        Stop receiving and close the sockets
+        """
+
+        self.closed = True
+        if self.receiver is not None:
+            self.receiver.join()
+            self.sub_socket.close()
+        if self.pub_socket is not None:
+            self.pub_socket.close()
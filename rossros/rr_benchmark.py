@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""
+This file measures the overhead of RossROS, with and without the logging fast path.
+
+First, it times get_message/set_message pairs on a single bus.
+
+Second, it runs the graph from rr_demo.py with all loop delays set to zero, so that the nodes run
+as fast as RossROS lets them, and counts how many loop iterations each node completes per second.
+The printer is replaced by a consumer that reads the same buses without printing, so that the terminal
+does not limit the loop rate.
+
+Both measurements are made once with FAST_PATH off (every call goes through the logging decorators)
+and once with FAST_PATH on (the decorators are resolved when the objects are constructed).
+
+Usage:
+    python3 rr_benchmark.py [seconds per graph run]
+"""
+
+import rossros as rr
+import logging
+import sys
+import time
+import math
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+""" First Part: Bus operations """
+
+
+def bus_ops(n=100000):
+
+    bus = rr.Bus(0, "Benchmark bus")
+
+    t_start = time.perf_counter()
+    for i in range(n):
+        bus.set_message(i, "benchmark")
+        bus.get_message("benchmark")
+    elapsed = time.perf_counter() - t_start
+
+    # One get and one set per pass
+    return 2 * n / elapsed
+
+
+""" Second Part: The rr_demo.py graph """
+
+
+def graph_iterations(duration):
+
+    # Count the loop iterations of every node
+    counts = {"square": 0, "sawtooth": 0, "mult": 0, "reader": 0}
+
+    def square():
+        counts["square"] += 1
+        return (2 * math.floor(time.time() % 2)) - 1
+
+    def sawtooth():
+        counts["sawtooth"] += 1
+        return time.time() % 1
+
+    def mult(a, b):
+        counts["mult"] += 1
+        return a * b
+
+    def reader(*values):
+        counts["reader"] += 1
+
+    bSquare = rr.Bus(square(), "Square wave bus")
+    bSawtooth = rr.Bus(sawtooth(), "Sawtooth wave Bus")
+    bMultiplied = rr.Bus(sawtooth() * square(), "Multiplied wave bus")
+    bTerminate = rr.Bus(0, "Termination Bus")
+
+    # Don't count the calls made while setting up the buses
+    for name in counts:
+        counts[name] = 0
+
+    producer_consumer_list = [
+        rr.Producer(square, bSquare, 0, bTerminate, "Read square wave signal"),
+        rr.Producer(sawtooth, bSawtooth, 0, bTerminate, "Read sawtooth wave signal"),
+        rr.ConsumerProducer(mult, (bSquare, bSawtooth), bMultiplied, 0, bTerminate, "Multiply Waves"),
+        rr.Consumer(reader, (bSquare, bSawtooth, bMultiplied, bTerminate), 0, bTerminate, "Read all buses"),
+        rr.Timer(bTerminate, duration, 0.01, bTerminate, "Termination timer")]
+
+    t_start = time.perf_counter()
+    rr.runConcurrently(producer_consumer_list)
+    elapsed = time.perf_counter() - t_start
+
+    return {name: count / elapsed for name, count in counts.items()}
+
+
+""" Third Part: Compare the slow and the fast path """
+
+if __name__ == "__main__":
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    results = {}
+    for fast_path in (False, True):
+        rr.FAST_PATH = fast_path
+        results[fast_path] = (bus_ops(), graph_iterations(duration))
+
+    print("{:<28s}{:>14s}{:>14s}{:>10s}".format("", "FAST_PATH off", "FAST_PATH on", "speedup"))
+
+    slow, fast = results[False][0], results[True][0]
+    print("{:<28s}{:>14.0f}{:>14.0f}{:>9.1f}x".format("bus ops/sec", slow, fast, fast / slow))
+
+    for name in results[False][1]:
+        slow, fast = results[False][1][name], results[True][1][name]
+        print("{:<28s}{:>14.0f}{:>14.0f}{:>9.1f}x".format(name + " iterations/sec", slow, fast, fast / slow))
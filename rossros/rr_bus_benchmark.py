@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+This file compares the lock-based Bus with the SingleWriterBus, with one writer thread and several reader
+threads hammering the same bus.
+
+For each bus type and number of readers, it reports the writes per second of the writer and the reads per
+second of all readers together. The seqlock variant and the ArrayBus are measured with a 640x480 image
+written in place, against a Bus holding copies of the same image.
+
+Usage:
+    python3 rr_bus_benchmark.py [seconds per measurement] [largest number of readers]
+"""
+
+import rossros as rr
+import numpy as np
+import threading
+import sys
+import time
+
+
+def hammer(bus, readers, duration, message):
+    """
+    Run one writer and `readers` reader threads on the bus for `duration` seconds,
+    return the writes per second and reads per second
+    """
+
+    stop = threading.Event()
+    counts = [0] * (readers + 1)
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            if message is None:
+                bus.set_message(n, "writer")
+            elif hasattr(bus, "acquire"):
+                # Fill the array bus's own buffer in place
+                frame = bus.acquire("writer")
+                frame.flat[0] = n % 256
+                bus.set_message(frame, "writer")
+            else:
+                # Change the image in place, as a camera driver filling its buffer would
+                message.flat[0] = n % 256
+                bus.set_message(message, "writer")
+            n += 1
+        counts[0] = n
+
+    def read(index):
+        n = 0
+        while not stop.is_set():
+            bus.get_message("reader {:d}".format(index))
+            n += 1
+        counts[index] = n
+
+    threads = [threading.Thread(target=write)]
+    threads += [threading.Thread(target=read, args=(i + 1,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return counts[0] / duration, sum(counts[1:]) / duration
+
+
+class CopyingBus(rr.Bus):
+    """
+    Lock-based bus that stores a copy of each array, as an in-place writer would need without a seqlock
+    """
+
+    def set_message(self, message, _name='Unspecified function'):
+        super().set_message(message.copy(), _name)
+
+
+if __name__ == "__main__":
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    max_readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    cases = [("Bus", lambda: rr.Bus(0, "Bus"), None),
+             ("SingleWriterBus", lambda: rr.SingleWriterBus(0, "SingleWriterBus"), None),
+             ("Bus, image copies", lambda: CopyingBus(0, "Bus"), np.zeros((480, 640, 3), np.uint8)),
+             ("SingleWriterBus, seqlock", lambda: rr.SingleWriterBus(0, "SingleWriterBus", seqlock=True),
+              np.zeros((480, 640, 3), np.uint8)),
+             ("ArrayBus", lambda: rr.ArrayBus((480, 640, 3), np.uint8, "ArrayBus"), np.zeros((480, 640, 3), np.uint8))]
+
+    print("{:<28s}{:>8s}{:>14s}{:>14s}".format("bus", "readers", "writes/sec", "reads/sec"))
+    for name, make_bus, message in cases:
+        for readers in range(1, max_readers + 1):
+            writes, reads = hammer(make_bus(), readers, duration, message)
+            print("{:<28s}{:>8d}{:>14.0f}{:>14.0f}".format(name, readers, writes, reads))
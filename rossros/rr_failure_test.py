@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""
+This file checks that fixed-rate consumer-producers keep to their schedule after a failed pass, with each
+failure policy, in both rossros.py and rossros_asyncio.py.
+
+A producer running at 50 Hz raises an exception on its third pass:
+
+* with failure_policy="restart" it carries on with the following passes,
+* with failure_policy="safe_value" it also writes its safe value once,
+* with failure_policy="fail" the graph stops and runConcurrently raises the exception.
+
+Usage (from the directory above this one, as the checks import the rossros package):
+    python3 -m rossros.rr_failure_test
+or with pytest.
+"""
+
+from . import rossros
+from . import rossros_asyncio
+
+
+class Flaky:
+    """
+    Producer function that counts its calls and raises on one of them
+    """
+
+    def __init__(self, failing_call=3):
+        self.calls = 0
+        self.failing_call = failing_call
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls == self.failing_call:
+            raise ValueError("failed pass")
+        return self.calls
+
+
+def runFlaky(rr, failure_policy, duration=0.3):
+    """
+    Run a 50 Hz flaky producer with the given failure policy, and a consumer recording what it wrote
+    """
+
+    bOutput = rr.Bus(0, "Flaky output bus")
+    bTerminate = rr.Bus(0, "Termination Bus")
+    written = []
+
+    flaky = Flaky()
+    producer = rr.Producer(flaky, bOutput, 0, bTerminate, "Flaky producer", rate=50,
+                           failure_policy=failure_policy, safe_value=-1 if failure_policy == "safe_value" else None)
+
+    rr.runConcurrently([
+        producer,
+        rr.Consumer(written.append, bOutput, 0, bTerminate, "Record output", trigger="any"),
+        rr.Timer(bTerminate, duration, 0.01, bTerminate, "Termination timer")])
+
+    return producer, flaky, written
+
+
+def checkRestart(rr):
+
+    producer, flaky, written = runFlaky(rr, "restart")
+
+    assert producer.failures == 1
+    assert producer.restarts == 1
+    assert flaky.calls > 5, "the loop stopped after the failed pass"
+    assert -1 not in written
+
+
+def checkSafeValue(rr):
+
+    producer, flaky, written = runFlaky(rr, "safe_value")
+
+    assert producer.failures == 1
+    assert flaky.calls > 5, "the loop stopped after the failed pass"
+    assert written.count(-1) == 1
+
+
+def checkFail(rr):
+
+    try:
+        runFlaky(rr, "fail", duration=5)
+    except ValueError:
+        return
+
+    raise AssertionError("runConcurrently did not raise the failure")
+
+
+def test_rate_restart():
+    checkRestart(rossros)
+
+
+def test_rate_safe_value():
+    checkSafeValue(rossros)
+
+
+def test_rate_fail():
+    checkFail(rossros)
+
+
+def test_rate_restart_asyncio():
+    checkRestart(rossros_asyncio)
+
+
+def test_rate_safe_value_asyncio():
+    checkSafeValue(rossros_asyncio)
+
+
+def test_rate_fail_asyncio():
+    checkFail(rossros_asyncio)
+
+
+if __name__ == "__main__":
+
+    for name, check in sorted(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(name, "passed")
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+This file demonstrates a RossROS graph split across two programs (which can run on different machines)
+using ZmqBus. It is the graph from rr_demo.py, cut between the signal generators and the multiplier.
+
+The sender generates the square and sawtooth waves and publishes them on two ZmqBuses.
+
+The receiver subscribes to both buses, multiplies the waves, and prints the results together with the
+latency and drop counters of the buses.
+
+Usage (from the directory above this one, as rossros_zmq is part of the rossros package):
+    python3 -m rossros.rr_zmq_demo sender
+    python3 -m rossros.rr_zmq_demo receiver [sender address, default 127.0.0.1]
+    python3 -m rossros.rr_zmq_demo both
+"""
+
+from . import rossros as rr
+from .rossros_zmq import ZmqBus
+import logging
+import time
+import math
+import sys
+
+logging.getLogger().setLevel(logging.INFO)
+
+SQUARE_PORT = 5560
+SAWTOOTH_PORT = 5561
+
+
+""" First Part: Signal generation and processing functions (as in rr_demo.py) """
+
+
+def square():
+    return (2 * math.floor(time.time() % 2)) - 1
+
+
+def sawtooth():
+    return time.time() % 1
+
+
+def mult(a, b):
+    return a * b
+
+
+""" Second Part: The two halves of the graph """
+
+
+def sender(duration):
+
+    # The buses the sender writes are published for the receiver
+    bSquare = ZmqBus(square(), "Square wave bus", publish="tcp://*:{:d}".format(SQUARE_PORT))
+    bSawtooth = ZmqBus(sawtooth(), "Sawtooth wave Bus", publish="tcp://*:{:d}".format(SAWTOOTH_PORT))
+    bTerminate = rr.Bus(0, "Termination Bus")
+
+    producer_consumer_list = [
+        rr.Producer(square, bSquare, 0.05, bTerminate, "Read square wave signal"),
+        rr.Producer(sawtooth, bSawtooth, 0.05, bTerminate, "Read sawtooth wave signal"),
+        rr.Timer(bTerminate, duration, 0.01, bTerminate, "Termination timer")]
+
+    return producer_consumer_list, (bSquare, bSawtooth)
+
+
+def receiver(duration, address):
+
+    # The receiver gets the same buses from the sender; multiplyWaves runs whenever either changes
+    bSquare = ZmqBus(0, "Square wave bus", subscribe="tcp://{:s}:{:d}".format(address, SQUARE_PORT))
+    bSawtooth = ZmqBus(0, "Sawtooth wave Bus", subscribe="tcp://{:s}:{:d}".format(address, SAWTOOTH_PORT))
+    bMultiplied = rr.Bus(0, "Multiplied wave bus")
+    bTerminate = rr.Bus(0, "Termination Bus")
+
+    producer_consumer_list = [
+        rr.ConsumerProducer(mult, (bSquare, bSawtooth), bMultiplied, 0, bTerminate, "Multiply Waves",
+                            trigger="any"),
+        rr.Printer((bSquare, bSawtooth, bMultiplied, bTerminate), 0.25, bTerminate,
+                   "Print raw and derived data", "Data bus readings are: "),
+        rr.Timer(bTerminate, duration, 0.01, bTerminate, "Termination timer")]
+
+    return producer_consumer_list, (bSquare, bSawtooth)
+
+
+""" Third Part: Run the chosen half (or both) and report the bus counters """
+
+if __name__ == "__main__":
+
+    role = sys.argv[1] if len(sys.argv) > 1 else "both"
+    address = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+
+    producer_consumer_list, buses = [], []
+    if role in ("sender", "both"):
+        nodes, _ = sender(5 if role == "both" else 10)
+        producer_consumer_list += nodes
+    if role in ("receiver", "both"):
+        nodes, buses = receiver(4, address)
+        producer_consumer_list += nodes
+
+    rr.runConcurrently(producer_consumer_list)
+
+    for bus in buses:
+        print(bus.name, bus.getStats())
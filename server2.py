@@ -6,51 +6,130 @@ fpath = os.path.join(os.path.dirname(__file__), "ArmPi")  # nopep8
 sys.path.insert(0, fpath)  # nopep8
 
 import cv2 as cv
+import numpy as np
 import time
 import Camera
 from LABConfig import *
 from ArmIK.Transform import *
 from ArmIK.ArmMoveIK import *
 from CameraCalibration.CalibrationConfig import *
+from RateControl import RateController
+from JpegEncoder import getEncoder
 import zmq
 import sys
 import time
 import json
 
 
-def mogrify(topic, msg):
-    """json encode the message and prepend the topic"""
-    return topic + " " + json.dumps(msg)
+def mogrify(topic, header, payload):
+    """Prepend the topic and a json header line to the binary payload"""
+    return bytes(topic + " " + json.dumps(header) + "\n", "utf-8") + payload
+
+
+def changed_tiles(img, ref, tile_size, threshold):
+    """Rectangles (x, y, w, h) of the tiles that differ from ref, merged into runs along each tile row"""
+    h, w = img.shape[:2]
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    diff = cv.absdiff(img, ref).max(axis=2)
+    # area interpolation averages the difference over every tile in one pass
+    tile_diff = cv.resize(diff, (cols, rows), interpolation=cv.INTER_AREA)
+    rects = []
+    for r in range(rows):
+        changed = np.flatnonzero(tile_diff[r] > threshold)
+        if len(changed) == 0:
+            continue
+        # split the changed columns into runs of adjacent tiles
+        for run in np.split(changed, np.flatnonzero(np.diff(changed) > 1) + 1):
+            x, y = run[0] * tile_size, r * tile_size
+            rects.append((int(x), int(y), int(min((run[-1] + 1) * tile_size, w) - x), int(min(tile_size, h - y))))
+    return rects
 
 
 my_camera = Camera.Camera()
 my_camera.camera_open()
 
+# Optional delta mode: between keyframes only the tiles that changed against the last keyframe are sent
+delta_mode = "--delta" in sys.argv
+if delta_mode:
+    sys.argv.remove("--delta")
+tile_size = 32
+change_threshold = 8  # mean absolute difference of a tile that counts as a change
+keyframe_interval = 30  # frames
+max_changed_ratio = 0.5  # send a keyframe instead when more of the image has changed
+
 # Set the port
 port = "5556"  # It should be fine to use the default
 if len(sys.argv) > 1:
     port = sys.argv[1]
     int(port)
 
+# Stream targets, the rate controller trades quality, resolution and frame rate to meet them
+target_fps = 10
+target_kbps = 2000
+if len(sys.argv) > 2:
+    target_kbps = float(sys.argv[2])
+
 # Socket to publish
 context = zmq.Context()
 socket = context.socket(zmq.PUB)
 socket.bind("tcp://*:%s" % port)
 
+# Socket to receive the client's reports of how many frames it got out of a range of sequence numbers, on the next port
+feedback = context.socket(zmq.PULL)
+feedback.bind("tcp://*:%d" % (int(port) + 1))
+
 # Set topic
 topic = "perception"  # This should match the server's topic name
 
-count = 0
+controller = RateController(target_kbps=target_kbps, target_fps=target_fps)
+encoder = getEncoder()  # turbojpeg if it is installed, opencv otherwise
+seq = 0
+keyframe = None
+key_seq = 0
 
 while True:
-    time.sleep(0.5)
+    time.sleep(1.0 / controller.target_fps)
+
+    # Read all pending client reports, every sent frame has its own seq, so the frames sent over
+    # the client's window are the seq range it reports
+    while True:
+        try:
+            report = json.loads(feedback.recv(flags=zmq.NOBLOCK))
+        except zmq.Again:
+            break
+        controller.feedback(report["received"], report["last"] - report["after"])
+        print("stream settings: %s" % controller.settings())
 
     img = my_camera.frame
-    if img is None:
+    if img is None or not controller.should_send():
         continue
 
-    message = cv.imencode(".jpg", img)[1].tolist()
+    if controller.scale != 1.0:
+        img = cv.resize(img, None, fx=controller.scale, fy=controller.scale, interpolation=cv.INTER_AREA)
+    jpeg_quality = controller.quality
+
+    seq += 1
+    header = {"seq": seq, "quality": controller.quality, "scale": controller.scale}
+
+    rects = None
+    if delta_mode and keyframe is not None and keyframe.shape == img.shape and seq - key_seq < keyframe_interval:
+        rects = changed_tiles(img, keyframe, tile_size, change_threshold)
+        if sum(w * h for x, y, w, h in rects) > max_changed_ratio * img.shape[0] * img.shape[1]:
+            rects = None
 
-    print("server sends: the image at the topic: " + topic)
+    if rects is None:
+        message = encoder.encode(img, jpeg_quality)
+        if delta_mode:
+            keyframe = img
+            key_seq = seq
+            header.update({"type": "key", "key": key_seq})
+    else:
+        # Tiles are sent as separate jpegs, the header lists their rectangles and sizes
+        tiles = [encoder.encode(img[y:y + h, x:x + w], jpeg_quality) for x, y, w, h in rects]
+        message = b"".join(tiles)
+        header.update({"type": "delta", "key": key_seq,
+                       "tiles": [[x, y, w, h, len(t)] for (x, y, w, h), t in zip(rects, tiles)]})
 
-    socket.send(bytes(mogrify(topic, message), "utf-8"))
+    # A PUB send never blocks, so its duration says nothing about the link
+    socket.send(mogrify(topic, header, message))
+    controller.update(len(message), None)